@@ -0,0 +1,421 @@
+#!/usr/bin/env python3
+"""bench — End-to-end benchmarks of chat.py against the stub server.
+
+Measures the client's own overhead (no LLM involved): startup, per-turn
+overhead for the streaming and polling paths, rendering, and memory for
+large histories and large tool outputs. Rendering goes to an in-memory
+console so terminal speed is not measured.
+
+    python bench.py                 # all scenarios
+    python bench.py turn history    # selected scenarios
+    python bench.py --json          # machine-readable output
+    python bench.py startup --check # fail if `import chat` is over budget
+"""
+
+import argparse
+import atexit
+import gc
+import io
+import json
+import os
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import types
+
+from opencode_ai import Opencode
+from rich.console import Console
+
+# chat.py reads its store and cache paths at import time; point them at a
+# scratch directory so stub sessions, transcripts and spend never reach the
+# user's own transcript store (and /cost)
+SCRATCH = tempfile.mkdtemp(prefix="opencode-bench-")
+atexit.register(shutil.rmtree, SCRATCH, True)
+os.environ["OPENCODE_CHAT_DB"] = os.path.join(SCRATCH, "transcripts.db")
+os.environ["OPENCODE_CHAT_CACHE_DIR"] = SCRATCH
+
+import chat  # noqa: E402
+from stub_server import start_server  # noqa: E402
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+IMPORT_BUDGET_MS = 200  # p50 of `import chat` in a fresh interpreter (--check)
+DEFERRED_MODULES = ["opencode_ai", "rich.markdown", "rich.panel", "rich.table", "asyncio"]
+
+# Time `import chat` inside the child, so interpreter startup is not counted
+IMPORT_PROBE = (
+    "import json, sys, time\n"
+    "started = time.perf_counter()\n"
+    "import chat\n"
+    "elapsed = (time.perf_counter() - started) * 1000\n"
+    "print(json.dumps([elapsed, [m for m in %r if m in sys.modules]]))\n"
+) % (DEFERRED_MODULES,)
+
+
+# ---------------------------------------------------------------------------
+# Section A: Helpers
+# ---------------------------------------------------------------------------
+
+
+def quiet_console():
+    """Send chat.py's output to an in-memory console."""
+    chat.console = Console(file=io.StringIO(), width=100, force_terminal=True)
+
+
+def timed(fn, repeat):
+    """Run `fn` `repeat` times; return the list of durations in ms."""
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    return samples
+
+
+def summarize(samples):
+    """Mean/p50/p95/max of a list of ms durations."""
+    ordered = sorted(samples)
+    p95 = ordered[min(len(ordered) - 1, int(round(0.95 * (len(ordered) - 1))))]
+    return {
+        "n": len(ordered),
+        "mean_ms": round(statistics.mean(ordered), 2),
+        "p50_ms": round(statistics.median(ordered), 2),
+        "p95_ms": round(p95, 2),
+        "max_ms": round(ordered[-1], 2),
+    }
+
+
+def first_output(fn):
+    """Run `fn` on a fresh in-memory console; return (total ms, ms until first write)."""
+
+    class Recorder(io.StringIO):
+        first = None
+
+        def write(self, text):
+            if self.first is None:
+                self.first = time.perf_counter()
+            return super().write(text)
+
+    chat.console = Console(file=Recorder(), width=100, force_terminal=True)
+    started = time.perf_counter()
+    fn()
+    total = (time.perf_counter() - started) * 1000
+    first = ((chat.console.file.first or time.perf_counter()) - started) * 1000
+    quiet_console()
+    return total, first
+
+
+def peak_memory(fn):
+    """Run `fn` under tracemalloc; return (result, peak MB allocated)."""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        result = fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, round(peak / 1e6, 2)
+
+
+def retained_memory(fn):
+    """Run `fn` under tracemalloc; return MB it leaves allocated (stub server excluded)."""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        fn()
+        chat.flush_pending_writes()
+        gc.collect()
+        snapshot = tracemalloc.take_snapshot().filter_traces(
+            [tracemalloc.Filter(False, "*stub_server.py")]
+        )
+    finally:
+        tracemalloc.stop()
+    return round(sum(stat.size for stat in snapshot.statistics("filename")) / 1e6, 2)
+
+
+def connect(base_url):
+    """Point chat.py at a stub server, with a fresh session."""
+    chat.client = Opencode(base_url=base_url)
+    chat.provider_id = chat.DEFAULT_PROVIDER
+    chat.model_id = chat.DEFAULT_MODEL
+    chat.message_cache.clear()
+    chat.session_id = chat.client.session.create(extra_body={}).id
+
+
+# ---------------------------------------------------------------------------
+# Section B: Scenarios
+# ---------------------------------------------------------------------------
+
+
+def bench_startup(args):
+    """Import time of chat.py, `chat.py --version` wall time and server discovery time."""
+    imports = []
+    eager = set()
+    for _ in range(args.repeat):
+        out = subprocess.run(
+            [sys.executable, "-c", IMPORT_PROBE], cwd=HERE, check=True,
+            capture_output=True, text=True,
+        ).stdout
+        elapsed, loaded = json.loads(out)
+        imports.append(elapsed)
+        eager.update(loaded)
+    version = []
+    for _ in range(args.repeat):
+        started = time.perf_counter()
+        subprocess.run(
+            [sys.executable, "chat.py", "--version"], cwd=HERE, check=True,
+            stdout=subprocess.DEVNULL,
+        )
+        version.append((time.perf_counter() - started) * 1000)
+
+    server, base_url = start_server()
+    old = os.environ.get("OPENCODE_BASE_URL")
+    os.environ["OPENCODE_BASE_URL"] = base_url
+    try:
+        discovery = timed(chat.find_opencode_port, args.repeat)
+    finally:
+        if old is None:
+            os.environ.pop("OPENCODE_BASE_URL", None)
+        else:
+            os.environ["OPENCODE_BASE_URL"] = old
+        server.shutdown()
+    return {
+        "import": summarize(imports),
+        "deferred_but_imported": sorted(eager),
+        "version": summarize(version),
+        "discovery": summarize(discovery),
+    }
+
+
+def check_startup(result, budget_ms):
+    """Budget failures of a startup result, as messages (empty if within budget)."""
+    failures = []
+    if result["import"]["p50_ms"] > budget_ms:
+        failures.append(f"import chat p50 {result['import']['p50_ms']} ms > budget {budget_ms} ms")
+    if result["deferred_but_imported"]:
+        failures.append(f"imported at startup: {', '.join(result['deferred_but_imported'])}")
+    return failures
+
+
+def bench_turn(args):
+    """Per-turn wall time with a zero-latency server, i.e. client overhead."""
+    server, base_url = start_server(
+        text_size=args.text_size, tool_parts=args.tool_parts,
+        tool_output_size=args.tool_output_size,
+    )
+    try:
+        connect(base_url)
+        results = {}
+        for mode, streaming in (("stream", True), ("poll", False)):
+            chat.stream_enabled = streaming
+            results[mode] = summarize(
+                timed(lambda: chat.send_message("benchmark"), args.turns)
+            )
+        return results
+    finally:
+        server.shutdown()
+
+
+def bench_history(args):
+    """Fetch + render cost for a long session (default 1,000 messages)."""
+    server, base_url = start_server(text_size=args.text_size, tool_output_size=2000)
+    try:
+        connect(base_url)
+        chat.session_id = server.state.seed_history(args.history)
+
+        _, fetch_mb = peak_memory(lambda: chat.fetch_messages(chat.session_id))
+        chat.message_cache.clear()
+        cache_mb = retained_memory(lambda: chat.fetch_messages(chat.session_id))
+        refetch = timed(lambda: chat.fetch_messages(chat.session_id), args.repeat)
+        last = timed(lambda: chat.display_response(chat.session_id), args.repeat)
+        page = timed(chat.show_history, args.repeat)
+        deep = timed(lambda: chat.show_history(page=args.history // chat.HISTORY_PAGE), args.repeat)
+        return {
+            "messages": args.history,
+            "first_fetch_peak_mb": fetch_mb,
+            "cache_retained_mb": cache_mb,
+            "refetch": summarize(refetch),
+            "render_last_response": summarize(last),
+            "history_page": summarize(page),
+            "history_oldest_page": summarize(deep),
+        }
+    finally:
+        server.shutdown()
+
+
+def bench_large_output(args):
+    """Fetch + render cost and memory for a turn with one huge tool output."""
+    size = args.large_output_mb * 1_000_000
+    server, base_url = start_server(text_size=200, tool_parts=1, tool_output_size=size)
+    try:
+        connect(base_url)
+        chat.stream_enabled = False
+        started = time.perf_counter()
+        _, turn_mb = peak_memory(lambda: chat.send_message("benchmark"))
+        turn_ms = (time.perf_counter() - started) * 1000
+        render = timed(lambda: chat.display_response(chat.session_id), args.repeat)
+        retained = retained_memory(lambda: chat.send_message("benchmark"))
+        return {
+            "output_mb": args.large_output_mb,
+            "turn_ms": round(turn_ms, 2),
+            "turn_peak_mb": turn_mb,
+            "retained_after_turn_mb": retained,
+            "render_last_response": summarize(render),
+        }
+    finally:
+        server.shutdown()
+
+
+def bench_markdown(args):
+    """One long reply with many code blocks: one-shot Markdown vs render_markdown(),
+    with an empty and with a warm render cache."""
+    from rich.markdown import Markdown
+
+    prose = "Some text with *emphasis*, `inline code` and a [link](https://example.com).\n\n"
+    code = "```python\n" + "def double(x):\n    return x * 2  # comment\n" * 40 + "```\n\n"
+    block = prose * 3 + code
+    text = block * max(1, args.markdown_kb * 1000 // len(block))
+
+    def incremental():
+        chat.render_cache.clear()
+        chat.render_cache_bytes = 0
+        chat.render_markdown(text)
+
+    results = {"chars": len(text)}
+    for name, fn in (
+        ("one_shot", lambda: chat.console.print(Markdown(text))),
+        ("incremental", incremental),
+        ("warm_cache", lambda: chat.render_markdown(text)),
+    ):
+        samples = [first_output(fn) for _ in range(max(1, args.repeat // 2))]
+        results[name] = summarize([total for total, _ in samples])
+        results[name + "_first_output"] = summarize([first for _, first in samples])
+    return results
+
+
+def bench_sessions(args):
+    """/sessions with many sessions on the server (default 10,000): one page vs
+    the whole list, with and without server-side paging."""
+    results = {"sessions": args.sessions}
+    for label, paging in (("", True), ("unpaged_server_", False)):
+        server, base_url = start_server(session_paging=paging)
+        try:
+            connect(base_url)
+            server.state.seed_sessions(args.sessions)
+            results[label + "page"] = summarize(timed(chat.list_sessions, args.repeat))
+            results[label + "filtered_page"] = summarize(
+                timed(lambda: chat.list_sessions(query="retry"), args.repeat)
+            )
+            if paging:
+                rounds = max(1, args.repeat // 5)
+                results["whole_list"] = summarize(
+                    timed(lambda: chat.list_sessions(limit=args.sessions + 1), rounds)
+                )
+        finally:
+            server.shutdown()
+    return results
+
+
+def bench_resume(args):
+    """Resolving a session by ID prefix among many (default 10,000): the prefix
+    index vs. scanning the session list."""
+    rng = random.Random(0)
+    sessions = [
+        types.SimpleNamespace(id="ses_%016x" % rng.getrandbits(64), title=f"Task {i}")
+        for i in range(args.sessions)
+    ]
+    chat.session_index = {"ids": [], "titles": [], "title": {}}  # start from an empty index
+    try:
+        build = timed(lambda: chat.index_sessions(sessions), 1)
+        prefixes = [chat.short_id(s.id) for s in rng.sample(sessions, 100)]
+        lookup = timed(lambda: [chat.lookup_sessions(p) for p in prefixes], args.repeat)
+        scan = timed(
+            lambda: [[s for s in sessions if s.id.startswith(p)] for p in prefixes], args.repeat
+        )
+    finally:
+        chat.session_index = None
+    return {
+        "sessions": args.sessions,
+        "index_build_ms": round(build[0], 2),
+        "lookup_100": summarize(lookup),
+        "scan_100": summarize(scan),
+    }
+
+
+SCENARIOS = {
+    "startup": bench_startup,
+    "turn": bench_turn,
+    "history": bench_history,
+    "large-output": bench_large_output,
+    "markdown": bench_markdown,
+    "sessions": bench_sessions,
+    "resume": bench_resume,
+}
+
+
+# ---------------------------------------------------------------------------
+# Section C: Entry point
+# ---------------------------------------------------------------------------
+
+
+def print_report(report):
+    """Human-readable report: one line per measurement."""
+    for scenario, data in report.items():
+        print(f"== {scenario}")
+        for key, value in data.items():
+            if isinstance(value, dict):
+                stats = ", ".join(f"{k}={v}" for k, v in value.items())
+                print(f"  {key:<24} {stats}")
+            else:
+                print(f"  {key:<24} {value}")
+
+
+def main():
+    """Entry point."""
+    parser = argparse.ArgumentParser(description="Benchmark chat.py against the stub server")
+    parser.add_argument("scenarios", nargs="*", metavar="SCENARIO",
+                        help=f"scenarios to run: {', '.join(SCENARIOS)} (default: all)")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    parser.add_argument("--repeat", type=int, default=10, help="samples per measurement")
+    parser.add_argument("--turns", type=int, default=20, help="turns per mode in 'turn'")
+    parser.add_argument("--history", type=int, default=1000, help="messages in 'history'")
+    parser.add_argument("--text-size", type=int, default=2000)
+    parser.add_argument("--tool-parts", type=int, default=3)
+    parser.add_argument("--tool-output-size", type=int, default=2000)
+    parser.add_argument("--large-output-mb", type=int, default=10)
+    parser.add_argument("--sessions", type=int, default=10000,
+                        help="sessions in 'sessions' and 'resume'")
+    parser.add_argument("--markdown-kb", type=int, default=50, help="reply size in 'markdown'")
+    parser.add_argument("--check", action="store_true",
+                        help="exit 1 if 'startup' exceeds the import-time budget")
+    parser.add_argument("--import-budget", type=float, default=IMPORT_BUDGET_MS, metavar="MS",
+                        help=f"import-time budget for --check (default: {IMPORT_BUDGET_MS})")
+    args = parser.parse_args()
+    unknown = [name for name in args.scenarios if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenario: {', '.join(unknown)}")
+
+    quiet_console()
+    report = {}
+    for name in args.scenarios or list(SCENARIOS):
+        report[name] = SCENARIOS[name](args)
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+
+    if args.check and "startup" in report:
+        failures = check_startup(report["startup"], args.import_budget)
+        for failure in failures:
+            print(f"FAIL: {failure}", file=sys.stderr)
+        if failures:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
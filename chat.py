@@ -1,19 +1,33 @@
 #!/usr/bin/env python3
 """opencode-chat — A terminal chat client for OpenCode."""
 
+__version__ = "0.1.0"
+
 import os
 import sys
 import signal
 import subprocess
 import time
+import argparse
 import atexit
+import bisect
+import collections
+import contextlib
+import datetime
+import hashlib
 import json
-
-from opencode_ai import Opencode, APIConnectionError, APIStatusError
+import re
+import queue
+import sqlite3
+import threading
+import types
+
+# Only what the first prompt needs is imported here. The SDK (pydantic models),
+# rich.markdown (markdown-it, Pygments), Panel/Table, asyncio and the thread
+# pool are imported where they are used; see prewarm_imports().
+import httpx
 from rich.console import Console
-from rich.markdown import Markdown
-from rich.panel import Panel
-from rich.table import Table
+from rich.markup import escape
 
 # ---------------------------------------------------------------------------
 # Section A: Globals
@@ -22,31 +36,263 @@ from rich.table import Table
 SERVE_PORT = 54321
 DEFAULT_PROVIDER = "opencode"
 DEFAULT_MODEL = "kimi-k2.5-free"
+STREAM_GRACE = 2.0  # seconds to wait for trailing events after chat returns
+PROBE_PORTS = [SERVE_PORT, 4096, 3000, 8080]
+PROBE_TIMEOUT = httpx.Timeout(2.0, connect=0.25)
+HTTP_TIMEOUT = httpx.Timeout(connect=5.0, read=60.0, write=10.0, pool=10.0)
+HTTP_LIMITS = httpx.Limits(
+    max_connections=20, max_keepalive_connections=10, keepalive_expiry=30.0
+)
+STARTUP_TIMEOUT = float(os.environ.get("OPENCODE_STARTUP_TIMEOUT", "15"))
+HEALTH_INTERVAL = 15.0  # seconds between background health checks (async mode)
+MESSAGE_WINDOW = 20  # newest messages requested by an incremental fetch
+HISTORY_PAGE = 20  # messages per /history page
+SESSIONS_PAGE = 20  # sessions per /sessions page
+SESSIONS_PREFETCH_TTL = 10.0  # seconds the startup /sessions page stays usable
+STORE_PATH = os.environ.get("OPENCODE_CHAT_DB") or os.path.join(
+    os.environ.get("XDG_DATA_HOME") or os.path.expanduser("~/.local/share"),
+    "opencode-chat",
+    "transcripts.db",
+)
+SEARCH_LIMIT = 20  # hits shown by /search
+SEARCH_MAX_CHARS = 65536  # indexed characters per part (huge tool outputs are cut)
+STATS_WINDOW = 500  # samples kept per session and phase for /stats
+HIGHLIGHT_BUDGET = int(os.environ.get("OPENCODE_CHAT_HIGHLIGHT_BUDGET", "20000"))
+MARKDOWN_CHUNK = 4096  # prose characters handed to one Markdown() render
+TOOL_PREVIEW = 500  # characters of tool output shown in a tool panel
+SPILL_CHARS = int(float(os.environ.get("OPENCODE_CHAT_SPILL_KB", "64")) * 1024)
+PAGE_CHUNK = 1 << 16  # bytes per write when a spill file is printed without a pager
+RENDER_CACHE_BYTES = int(float(os.environ.get("OPENCODE_CHAT_RENDER_CACHE_MB", "32")) * 1024 * 1024)
+SESSION_POOL_SIZE = int(os.environ.get("OPENCODE_CHAT_SESSION_POOL", "2"))
+SESSION_POOL_DRAIN = 3.0  # seconds exit waits for pool sessions still being created
+BUDGET_SESSION = float(os.environ.get("OPENCODE_CHAT_BUDGET_SESSION", "0"))  # $; 0 = no alerts
+BUDGET_DAY = float(os.environ.get("OPENCODE_CHAT_BUDGET_DAY", "0"))  # $ across sessions per day
+BUDGET_WARN = 0.8  # fraction of a budget at which the first alert is shown
+CAP_KINDS = ("tokens", "cost", "seconds", "tools")  # hard caps; see TurnGuard
+STATS_PHASES = ["turn", "first_output", "chat", "fetch", "parse", "render"]
+CATALOG_TTL = float(os.environ.get("OPENCODE_CHAT_CATALOG_TTL", "300"))
+CACHE_DIR = os.environ.get("OPENCODE_CHAT_CACHE_DIR") or os.path.join(
+    os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"),
+    "opencode-chat",
+)
 console = Console()
 oc_process = None
 client = None
+async_client = None
+http_client = None  # shared httpx.Client behind every sync Opencode client
+http_lock = threading.Lock()
 session_id = None
 provider_id = None
 model_id = None
+stream_enabled = os.environ.get("OPENCODE_CHAT_STREAM", "1") != "0"
+message_cache = {}  # session id -> {"order", "items", "settled", "filter"}
+message_lock = threading.RLock()  # guards message_cache (turns persist in the background)
+store = None  # sqlite3 connection to the local transcript store
+store_lock = threading.Lock()
+store_enabled = os.environ.get("OPENCODE_CHAT_STORE", "1") != "0"
+pending_writes = []  # background write-through threads, joined on exit
+search_enabled = False  # SQLite has FTS5 and parts_fts exists
+catalog = None  # {"data": AppProvidersResponse, "hash": str, "fetched": monotonic time}
+catalog_lock = threading.Lock()
+catalog_refreshing = False
+startup_tasks = None  # background startup work, collected by finish_startup()
+prefetched_sessions = None  # (monotonic time, first /sessions page) warmed at startup, used once
+sessions_changed = 0.0  # monotonic time of the last turn or switch (titles and order may change)
+session_pool = collections.deque()  # pre-created, unused sessions (see take_session())
+session_pool_lock = threading.Lock()
+session_pool_settled = threading.Condition(session_pool_lock)  # notified as creations finish
+session_pool_pending = 0  # pool sessions being created (or, after close, being deleted)
+session_pool_closed = False  # set on exit; late arrivals are deleted
+session_pool_used = False  # drain_session_pool() registered with atexit
+spill_dir = None  # temporary directory holding spilled tool outputs
+spilled = {}  # tool part id -> (spill file path, characters of output)
+render_cache = collections.OrderedDict()  # LRU: key -> (segments, estimated bytes)
+render_cache_bytes = 0
+render_cache_counts = {"hits": 0, "misses": 0}
+render_lock = threading.Lock()
+turn_stats = {}  # session id -> {phase: deque of seconds}
+workspace = {}  # attached session id -> {"title", "turn" (background thread), "unseen"}
+notifications = collections.deque()  # background-turn notices waiting for the prompt
+notify_lock = threading.Lock()
+prompt_waiting = threading.Event()  # the REPL is blocked at an idle prompt
+# {"ids": sorted IDs, "titles": sorted (folded title, id), "title": {id: title}}
+session_index = None
+session_index_lock = threading.Lock()
+budget_alerts = set()  # (scope, key, level) budget alerts already shown
+turn_caps = {  # kind -> limit per turn (0 = none); changed with /caps
+    kind: float(os.environ.get(f"OPENCODE_CHAT_TURN_MAX_{kind.upper()}", "0"))
+    for kind in CAP_KINDS
+}
+session_caps = {  # kind -> limit per session, counting earlier turns from the store
+    kind: float(os.environ.get(f"OPENCODE_CHAT_SESSION_MAX_{kind.upper()}", "0"))
+    for kind in CAP_KINDS
+}
+
+
+@contextlib.contextmanager
+def phase_timer(phase, sid=None):
+    """Time a block with a monotonic clock and record it under `phase`."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_timing(phase, time.perf_counter() - started, sid)
+
+
+def record_timing(phase, seconds, sid=None):
+    """Add a sample to the rolling window of `phase` for a session."""
+    phases = turn_stats.setdefault(sid or session_id, {})
+    samples = phases.get(phase)
+    if samples is None:
+        samples = phases.setdefault(phase, collections.deque(maxlen=STATS_WINDOW))
+    samples.append(seconds)
+
+
+def percentile(ordered, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not ordered:
+        return 0.0
+    rank = max(1, -(-pct * len(ordered) // 100))
+    return ordered[int(rank) - 1]
+
+
+def stats_summary(sid):
+    """Per-phase count/mean/p50/p95/p99/max (in ms) for a session."""
+    summary = {}
+    for phase, samples in list(turn_stats.get(sid, {}).items()):
+        ordered = sorted(samples)
+        if not ordered:
+            continue
+        summary[phase] = {
+            "count": len(ordered),
+            "mean_ms": round(sum(ordered) / len(ordered) * 1000, 2),
+            "p50_ms": round(percentile(ordered, 50) * 1000, 2),
+            "p95_ms": round(percentile(ordered, 95) * 1000, 2),
+            "p99_ms": round(percentile(ordered, 99) * 1000, 2),
+            "max_ms": round(ordered[-1] * 1000, 2),
+        }
+    return summary
+
+
+def get_http_client():
+    """Return the shared keep-alive connection pool, creating it on first use."""
+    global http_client
+    if http_client is None:
+        # Probes ask for it concurrently; build (and SSL-configure) it only once
+        with http_lock:
+            if http_client is None:
+                http_client = httpx.Client(
+                    limits=HTTP_LIMITS, timeout=HTTP_TIMEOUT, follow_redirects=True
+                )
+                atexit.register(close_http_client)
+    return http_client
+
+
+def close_http_client():
+    """Close the shared connection pool (idempotent)."""
+    global http_client
+    if http_client is not None:
+        http_client.close()
+        http_client = None
+
+
+def make_client(base_url, **options):
+    """Create an Opencode client on the shared connection pool.
+
+    Never call .close() on the result; that would close the shared pool.
+    """
+    from opencode_ai import Opencode
+    return Opencode(base_url=base_url, http_client=get_http_client(), **options)
+
+
+def make_async_client(base_url, limits=HTTP_LIMITS):
+    """Create an AsyncOpencode client with the same pool settings as make_client()."""
+    from opencode_ai import AsyncOpencode
+    return AsyncOpencode(
+        base_url=base_url,
+        http_client=httpx.AsyncClient(
+            limits=limits, timeout=HTTP_TIMEOUT, follow_redirects=True
+        ),
+    )
+
+
+def prewarm_imports():
+    """Import the SDK and Markdown renderer in a background thread.
+
+    Started once the server is found (or while `opencode serve` boots), so the
+    import overlaps with the user typing the first prompt rather than
+    competing with discovery for the GIL.
+    """
+
+    def run():
+        import opencode_ai  # noqa: F401
+        import rich.markdown  # noqa: F401
+
+    threading.Thread(target=run, daemon=True).start()
+
+
+def candidate_urls():
+    """Base URLs to probe: OPENCODE_BASE_URL, then OPENCODE_PORTS (or the defaults).
+
+    OPENCODE_PORTS is a comma-separated list of ports or full base URLs.
+    """
+    urls = []
+    base_url = os.environ.get("OPENCODE_BASE_URL")
+    if base_url:
+        urls.append(base_url.rstrip("/"))
+    env_ports = os.environ.get("OPENCODE_PORTS")
+    entries = env_ports.split(",") if env_ports else PROBE_PORTS
+    for entry in entries:
+        entry = str(entry).strip()
+        if not entry:
+            continue
+        url = entry.rstrip("/") if "://" in entry else f"http://127.0.0.1:{entry}"
+        if url not in urls:
+            urls.append(url)
+    return urls
+
+
+def _probe(url):
+    """Return `url` if an OpenCode server answers GET /session there, else raise.
+
+    Talks to the shared pool directly, so probing never waits on the SDK import.
+    """
+    resp = get_http_client().get(f"{url}/session", timeout=PROBE_TIMEOUT)
+    resp.raise_for_status()
+    # Non-OpenCode servers (or the SPA fallback) don't return a JSON list
+    if not isinstance(resp.json(), list):
+        raise ValueError(f"{url} is not an OpenCode server")
+    return url
 
 
 def find_opencode_port():
-    """Try to find a running OpenCode server by checking common ports."""
-    test_client = Opencode(base_url=os.environ.get("OPENCODE_BASE_URL"))
-    try:
-        test_client.session.list()
-        return test_client
-    except Exception:
-        pass
+    """Probe all candidate servers concurrently; return a healthy base URL.
 
-    # Check if there's a server on a non-default port by scanning known ports
-    for port in [SERVE_PORT, 4096, 3000, 8080]:
-        try:
-            test_client = Opencode(base_url=f"http://127.0.0.1:{port}")
-            test_client.session.list()
-            return test_client
-        except Exception:
-            pass
+    A healthy OPENCODE_BASE_URL always wins, even if a default port answers
+    first; otherwise the first of the others to answer is used.
+    """
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+    urls = candidate_urls()
+    if not urls:
+        return None
+
+    pool = ThreadPoolExecutor(max_workers=len(urls))
+    try:
+        futures = [pool.submit(_probe, url) for url in urls]
+        if os.environ.get("OPENCODE_BASE_URL"):
+            # candidate_urls() puts it first; the rest keep probing meanwhile
+            try:
+                return futures[0].result()
+            except Exception:
+                futures = futures[1:]
+        for future in as_completed(futures):
+            try:
+                return future.result()
+            except Exception:
+                continue
+    finally:
+        # Don't wait for slower probes; they time out on their own
+        pool.shutdown(wait=False)
 
     return None
 
@@ -55,15 +301,41 @@ def find_opencode_port():
 # ---------------------------------------------------------------------------
 
 
+def _watch_output(proc, ready, listen_url, output_tail):
+    """Reader thread: scan server output for its 'listening' line, keep draining.
+
+    The pipe must be drained for the life of the process or the server
+    would block once the OS pipe buffer fills up.
+    """
+    for line in proc.stdout:
+        line = line.rstrip()
+        output_tail.append(line)
+        if not ready.is_set() and "listening" in line.lower():
+            match = re.search(r"https?://\S+", line)
+            if match:
+                listen_url.append(match.group(0).rstrip("/"))
+            ready.set()
+
+
 def start_opencode():
-    """Spawn 'opencode serve' and wait for it to become healthy."""
-    global oc_process, client
+    """Spawn 'opencode serve' and wait for it to become healthy.
+
+    Readiness is detected from the server's "listening" output line or from
+    /session probes with exponential backoff (5 ms doubling up to 250 ms),
+    whichever comes first, within OPENCODE_STARTUP_TIMEOUT seconds. A URL
+    from the "listening" line is probed before the default one, which stays
+    a fallback. Returns the server's base URL.
+    """
+    global oc_process
     console.print("[dim]Starting OpenCode server...[/dim]")
     try:
         oc_process = subprocess.Popen(
             ["opencode", "serve", "--port", str(SERVE_PORT)],
-            stdout=subprocess.DEVNULL,
-            stderr=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            stdin=subprocess.DEVNULL,
+            text=True,
+            errors="replace",
         )
     except FileNotFoundError:
         console.print(
@@ -73,19 +345,52 @@ def start_opencode():
         sys.exit(1)
 
     atexit.register(cleanup_opencode)
-    client = Opencode(base_url=f"http://127.0.0.1:{SERVE_PORT}")
 
-    # Poll until healthy (up to 15s) using /session as health check
-    for i in range(30):
-        time.sleep(0.5)
-        try:
-            client.session.list()
-            console.print("[dim]OpenCode server is ready.[/dim]")
-            return
-        except Exception:
-            pass
+    ready = threading.Event()
+    listen_url = []
+    output_tail = collections.deque(maxlen=20)
+    watcher = threading.Thread(
+        target=_watch_output,
+        args=(oc_process, ready, listen_url, output_tail),
+        daemon=True,
+    )
+    watcher.start()
+
+    default_url = f"http://127.0.0.1:{SERVE_PORT}"
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    delay = 0.005
+    announced = False
+    while time.monotonic() < deadline:
+        if announced:
+            time.sleep(delay)
+        else:
+            # Wake early the first time the server announces it is listening
+            announced = ready.wait(timeout=delay)
+        # The announced URL first, the default one as a fallback
+        urls = [url for url in listen_url if url != default_url] + [default_url]
+        for url in urls:
+            try:
+                _probe(url)
+                console.print("[dim]OpenCode server is ready.[/dim]")
+                return url
+            except Exception:
+                pass
+        if oc_process.poll() is not None:
+            break
+        delay = min(delay * 2, 0.25)
 
-    console.print("[bold red]Error:[/] OpenCode server failed to start within 15s.")
+    if oc_process.poll() is not None:
+        watcher.join(timeout=1)
+        console.print(
+            f"[bold red]Error:[/] OpenCode server exited with code {oc_process.returncode}."
+        )
+    else:
+        console.print(
+            f"[bold red]Error:[/] OpenCode server failed to start within {STARTUP_TIMEOUT:g}s."
+        )
+    # Show the server's last words to explain the failure
+    for line in output_tail:
+        console.print(f"  {line}", style="dim", markup=False, highlight=False)
     cleanup_opencode()
     sys.exit(1)
 
@@ -106,34 +411,244 @@ def cleanup_opencode():
     oc_process = None
 
 
-def ensure_opencode():
-    """Make sure OpenCode is reachable; start it if not. Discover provider/model."""
+def _catalog_path():
+    """On-disk provider catalog snapshot for the current server."""
+    key = hashlib.sha256(str(client.base_url).encode()).hexdigest()[:16]
+    return os.path.join(CACHE_DIR, f"providers-{key}.json")
+
+
+def _load_catalog_snapshot():
+    """Load the on-disk catalog snapshot, or None if missing or unreadable."""
+    from opencode_ai.types.app_providers_response import AppProvidersResponse
+    try:
+        with open(_catalog_path()) as f:
+            snapshot = json.load(f)
+        return {
+            "data": AppProvidersResponse.construct(**snapshot["data"]),
+            "hash": snapshot["hash"],
+            "fetched": None,  # never fresh: revalidate against the server
+        }
+    except Exception:
+        return None
+
+
+def _fetch_catalog():
+    """Fetch GET /config/providers; reuse the parsed catalog if the payload is unchanged."""
+    from opencode_ai.types.app_providers_response import AppProvidersResponse
+    global catalog
+    resp = client.app.with_raw_response.providers()
+    body = resp.read()
+    digest = resp.headers.get("etag") or hashlib.sha256(body).hexdigest()
+
+    with catalog_lock:
+        if catalog is not None and catalog["hash"] == digest:
+            catalog["fetched"] = time.monotonic()
+            return catalog["data"]
+
+    raw = json.loads(body)
+    data = AppProvidersResponse.construct(**raw)
+    with catalog_lock:
+        catalog = {"data": data, "hash": digest, "fetched": time.monotonic()}
+
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        path = _catalog_path()
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            json.dump({"base_url": str(client.base_url), "hash": digest, "data": raw}, f)
+        os.replace(tmp, path)
+    except OSError:
+        pass
+    return data
+
+
+def _refresh_catalog_background():
+    """Revalidate the catalog in a daemon thread (at most one at a time)."""
+    global catalog_refreshing
+
+    def run():
+        global catalog_refreshing
+        try:
+            _fetch_catalog()
+        except Exception:
+            # An unrevalidated snapshot would otherwise be served for good:
+            # expire it so the TTL check fetches again next time
+            with catalog_lock:
+                if catalog is not None and catalog["fetched"] is None:
+                    catalog["fetched"] = time.monotonic() - CATALOG_TTL
+        finally:
+            catalog_refreshing = False
+
+    with catalog_lock:
+        if catalog_refreshing:
+            return
+        catalog_refreshing = True
+    threading.Thread(target=run, daemon=True).start()
+
+
+def get_providers(refresh=False, wait=True):
+    """Return the provider/model catalog, served from cache when possible.
+
+    Fresh in-memory data (younger than CATALOG_TTL) is returned as is. At
+    startup the on-disk snapshot is used immediately and revalidated in the
+    background. With `refresh`, the server is always queried. With
+    `wait=False`, returns None instead of blocking when nothing is cached.
+    """
+    global catalog
+    if refresh:
+        return _fetch_catalog()
+
+    with catalog_lock:
+        current = catalog
+    if current is None:
+        current = _load_catalog_snapshot()
+        if current is not None:
+            with catalog_lock:
+                if catalog is None:
+                    catalog = current
+            _refresh_catalog_background()
+            return current["data"]
+    elif current["fetched"] is None:
+        # Snapshot still being revalidated; good enough until then
+        return current["data"]
+    elif time.monotonic() - current["fetched"] < CATALOG_TTL:
+        return current["data"]
+
+    if not wait:
+        _refresh_catalog_background()
+        return current["data"] if current is not None else None
+    return _fetch_catalog()
+
+
+def ensure_opencode(connect=True):
+    """Make sure OpenCode is reachable; start it if not. Discover provider/model.
+
+    Returns the server's base URL. With `connect=False` the SDK client is not
+    built and the model not checked here: start_startup_tasks() does both in
+    the background.
+    """
     global client, provider_id, model_id
 
     # Try to find an already-running OpenCode server
-    found = find_opencode_port()
-    if found:
-        client = found
+    url = find_opencode_port()
+    if url:
         console.print("[dim]Connected to existing OpenCode server.[/dim]")
     else:
-        start_opencode()
+        prewarm_imports()
+        url = start_opencode()
 
     # Use hardcoded default, validate it exists
     provider_id = DEFAULT_PROVIDER
     model_id = DEFAULT_MODEL
+    if connect:
+        client = make_client(url)
+        console.print(model_note())
+    return url
+
+
+def model_note():
+    """Check the current model against the catalog; return a status line (markup)."""
     try:
-        providers_resp = client.app.providers()
+        providers_resp = get_providers(wait=False)
+        if providers_resp is None:
+            # First launch: don't block startup on the catalog
+            return f"[dim]Using {provider_id}/{model_id}[/dim]"
         known = {p.id: p for p in providers_resp.providers}
         if provider_id in known and model_id in known[provider_id].models:
-            console.print(f"[dim]Using {provider_id}/{model_id}[/dim]")
-        else:
-            console.print(
-                f"[yellow]Warning:[/] {provider_id}/{model_id} not found on server, "
-                f"using anyway. Run /models to see available options."
-            )
+            return f"[dim]Using {provider_id}/{model_id}[/dim]"
+        return (
+            f"[yellow]Warning:[/] {provider_id}/{model_id} not found on server, "
+            f"using anyway. Run /models to see available options."
+        )
     except Exception as e:
-        console.print(f"[yellow]Could not verify model:[/] {e}")
-        console.print(f"[dim]Using {provider_id}/{model_id}[/dim]")
+        return f"[yellow]Could not verify model:[/] {e}\n[dim]Using {provider_id}/{model_id}[/dim]"
+
+
+def _after(dependency, fn):
+    """Run `fn` once the `dependency` future has completed successfully."""
+    dependency.result()
+    return fn()
+
+
+def _connect(url):
+    """Build the SDK client (the SDK import is the slow part; see prewarm_imports())."""
+    global client
+    client = make_client(url)
+
+
+def _new_remote_session():
+    """POST /session."""
+    return client.session.create(extra_body={})
+
+
+def _warm_sessions():
+    """Fetch the first /sessions page once the startup session exists."""
+    global prefetched_sessions
+    started = time.monotonic()
+    prefetched_sessions = started, fetch_sessions(SESSIONS_PAGE)
+
+
+def drop_prefetched_sessions():
+    """Forget the warmed /sessions page: a turn or switch changes titles and order.
+
+    The time is kept too, so a warm-up still in flight is not used either.
+    """
+    global prefetched_sessions, sessions_changed
+    prefetched_sessions = None
+    sessions_changed = time.monotonic()
+
+
+def start_startup_tasks(url, resume=None):
+    """Build the client, create the session (or find the one `resume` names), check
+    the model and warm the session list in the background.
+
+    Returns at once, so the prompt shows as soon as the server is reachable;
+    finish_startup() collects the results before the first input is handled.
+    """
+    global startup_tasks
+    from concurrent.futures import ThreadPoolExecutor
+
+    prewarm_imports()
+    pool = ThreadPoolExecutor(max_workers=3, thread_name_prefix="startup")
+    connected = pool.submit(_connect, url)
+    if resume:
+        created = pool.submit(_after, connected, lambda: resolve_session(resume))
+    else:
+        created = pool.submit(_after, connected, _new_remote_session)
+    startup_tasks = {
+        "resume": resume,
+        "session": created,
+        "model": pool.submit(_after, connected, model_note),
+        "sessions": pool.submit(_after, created, _warm_sessions),
+    }
+    pool.shutdown(wait=False)
+
+
+def finish_startup():
+    """Wait for start_startup_tasks(): adopt the new session and report the model check."""
+    global startup_tasks, session_id
+    if startup_tasks is None:
+        return
+    tasks, startup_tasks = startup_tasks, None
+    try:
+        session = tasks["session"].result()
+    except ValueError as e:
+        console.print(f"[bold red]{escape(str(e))}[/]")
+        sys.exit(1)
+    except Exception as e:
+        action = "opening" if tasks["resume"] else "creating"
+        console.print(f"[bold red]Error {action} session:[/] {e}")
+        sys.exit(1)
+    console.print(tasks["model"].result())
+    session_id = session.id
+    attach_session(session)
+    store_sessions([session])
+    if tasks["resume"]:
+        title = f" ({escape(session.title)})" if session.title else ""
+        console.print(f"[dim]Resumed session {short_id(session_id)}{title}[/dim]")
+    else:
+        console.print(f"[dim]Session: {session_id[:8]}...[/dim]")
+    fill_session_pool()
 
 
 # ---------------------------------------------------------------------------
@@ -141,10 +656,240 @@ def ensure_opencode():
 # ---------------------------------------------------------------------------
 
 
+class Tokens:
+    """Token counts of a message or step."""
+
+    __slots__ = ("input", "output", "reasoning", "cache_read", "cache_write")
+
+    def __init__(self, raw):
+        cache = raw.get("cache") or {}
+        self.input = raw.get("input") or 0
+        self.output = raw.get("output") or 0
+        self.reasoning = raw.get("reasoning") or 0
+        self.cache_read = cache.get("read") or 0
+        self.cache_write = cache.get("write") or 0
+
+
+class ToolState:
+    """State of a tool call (status, title, input, output, error)."""
+
+    __slots__ = ("status", "title", "input", "output", "error")
+
+    def __init__(self, raw):
+        self.status = raw.get("status")
+        self.title = raw.get("title")
+        self.input = raw.get("input")
+        self.output = raw.get("output")
+        self.error = raw.get("error")
+
+
+class Part:
+    """A message part, with the attribute names renderers expect of SDK parts."""
+
+    __slots__ = ("id", "message_id", "type", "text", "tool", "state", "tokens", "cost")
+
+    def __init__(self, raw):
+        self.id = raw.get("id")
+        self.message_id = raw.get("messageID")
+        self.type = raw.get("type")
+        self.text = raw.get("text")
+        self.tool = raw.get("tool")
+        self.state = ToolState(raw["state"]) if raw.get("state") else None
+        self.tokens = Tokens(raw["tokens"]) if raw.get("tokens") else None
+        self.cost = raw.get("cost") or 0
+
+
+class Message:
+    """A message as the client keeps it, converted once from the raw JSON.
+
+    Slotted and flat (no `info` wrapper, no pydantic model): the fetch layer
+    builds these, so cached histories stay small and renderers do plain
+    attribute reads.
+    """
+
+    __slots__ = (
+        "id", "session_id", "role", "created", "completed", "provider_id", "model_id",
+        "cost", "tokens", "error", "parts",
+    )
+
+    def __init__(self, raw):
+        info = raw["info"]
+        time_info = info.get("time") or {}
+        self.id = info["id"]
+        self.session_id = info.get("sessionID")
+        self.role = info.get("role")
+        self.created = time_info.get("created")
+        self.completed = time_info.get("completed")
+        self.provider_id = info.get("providerID")
+        self.model_id = info.get("modelID")
+        self.cost = info.get("cost") or 0
+        self.tokens = Tokens(info["tokens"]) if info.get("tokens") else None
+        self.error = _error(info["error"]) if info.get("error") else None
+        self.parts = [Part(part) for part in raw.get("parts") or []]
+
+
+def _error(raw):
+    """Message error as `.name` and `.data.message` / `.data.provider_id`, like the SDK's."""
+    data = raw.get("data") or {}
+    return types.SimpleNamespace(
+        name=raw.get("name") or "Error",
+        data=types.SimpleNamespace(
+            message=data.get("message") or "", provider_id=data.get("providerID") or ""
+        ),
+    )
+
+
+def _fetch_raw_messages(sid, limit=None):
+    """GET /session/{id}/message as plain JSON, optionally only the newest `limit`."""
+    extra_query = {"limit": limit} if limit else None
+    with phase_timer("fetch", sid):
+        resp = client.session.with_raw_response.messages(sid, extra_query=extra_query)
+        return resp.json()
+
+
+def _is_settled(raw):
+    """Whether a raw message can no longer change (user, or finished assistant)."""
+    info = raw.get("info") or {}
+    if info.get("role") != "assistant":
+        return True
+    time_info = info.get("time") or {}
+    return bool(time_info.get("completed")) or info.get("error") is not None
+
+
+def fetch_messages(sid):
+    """Return all messages of a session, parsing only what changed since last call.
+
+    Messages are cached per session by ID and written through to the local
+    transcript store. Once a session is cached, only the newest
+    MESSAGE_WINDOW messages are requested; if the window overlaps the cache,
+    it replaces the cached tail. Settled messages are never re-parsed.
+    A full fetch is done on first use, when more than a window of messages is
+    new, and on every call if the server ignores the `limit` filter.
+    """
+    with message_lock:
+        cache = message_cache.setdefault(
+            sid, {"order": [], "items": {}, "settled": set(), "filter": True}
+        )
+        order = cache["order"]
+
+        raw_items = None
+        start = 0
+        if order and cache["filter"]:
+            window = _fetch_raw_messages(sid, limit=MESSAGE_WINDOW)
+            if len(window) > MESSAGE_WINDOW:
+                # Server ignored the filter; this already is the full list
+                cache["filter"] = False
+                raw_items = window
+            elif window:
+                first_id = window[0]["info"]["id"]
+                for i in range(len(order) - 1, -1, -1):
+                    if order[i] == first_id:
+                        raw_items = window
+                        start = i
+                        break
+
+        if raw_items is None:
+            raw_items = _fetch_raw_messages(sid)
+
+        items = cache["items"]
+        settled = cache["settled"]
+        tail = []
+        changed = []
+        parse_started = time.perf_counter()
+        for raw in raw_items:
+            mid = raw["info"]["id"]
+            if mid not in items or mid not in settled:
+                items[mid] = Message(spill_tool_outputs(raw))
+                changed.append(raw)
+                if _is_settled(raw):
+                    settled.add(mid)
+            tail.append(mid)
+        record_timing("parse", time.perf_counter() - parse_started, sid)
+
+        # Write-through: everything new or still changing goes to the local store
+        store_messages(sid, changed)
+
+        # Drop cached messages the server no longer returns (e.g. reverted)
+        kept = set(tail)
+        for mid in order[start:]:
+            if mid not in kept:
+                items.pop(mid, None)
+                settled.discard(mid)
+        order[start:] = tail
+
+        return [items[mid] for mid in order]
+
+
+def _spill_dir():
+    """The temporary directory for spilled tool outputs, removed on exit."""
+    global spill_dir
+    if spill_dir is None:
+        import shutil
+        import tempfile
+
+        spill_dir = tempfile.mkdtemp(prefix="opencode-chat-")
+        atexit.register(shutil.rmtree, spill_dir, True)
+    return spill_dir
+
+
+def spill_output(part_id, output):
+    """Write a tool output to its spill file and index it; returns the path."""
+    path = os.path.join(_spill_dir(), f"{part_id}.txt")
+    with open(path, "w", encoding="utf-8", errors="replace") as f:
+        f.write(output)
+    spilled[part_id] = (path, len(output))
+    return path
+
+
+def spill_tool_outputs(raw):
+    """`raw` with tool outputs over SPILL_CHARS moved to spill files (a copy if any moved).
+
+    Only a TOOL_PREVIEW-sized prefix stays in the parsed message; /output
+    reads the rest from disk, so big outputs aren't kept in memory all session.
+    """
+    parts = raw.get("parts") or []
+    if not any(
+        len((part.get("state") or {}).get("output") or "") > SPILL_CHARS for part in parts
+    ):
+        return raw
+    kept = []
+    for part in parts:
+        state = part.get("state") or {}
+        output = state.get("output") or ""
+        if part.get("type") == "tool" and len(output) > SPILL_CHARS:
+            spill_output(part["id"], output)
+            part = dict(part, state=dict(state, output=output[:TOOL_PREVIEW]))
+        kept.append(part)
+    return dict(raw, parts=kept)
+
+
+def persist_turn(sid):
+    """Background write-through after a streamed turn (which fetched nothing)."""
+
+    def run():
+        try:
+            fetch_messages(sid)
+        except Exception:
+            pass
+
+    if get_store() is not None:
+        pending_writes[:] = [t for t in pending_writes if t.is_alive()]
+        thread = threading.Thread(target=run, daemon=True)
+        pending_writes.append(thread)
+        thread.start()
+
+
+def flush_pending_writes(timeout=5.0):
+    """Wait (bounded) for background write-through to finish, e.g. before exit."""
+    deadline = time.monotonic() + timeout
+    for thread in list(pending_writes):
+        thread.join(max(0.0, deadline - time.monotonic()))
+
+
 def display_response(sid):
     """Fetch messages for a session and render the last assistant response."""
     try:
-        messages = client.session.messages(sid)
+        messages = fetch_messages(sid)
     except Exception as e:
         console.print(f"[bold red]Error fetching messages:[/] {e}")
         return
@@ -152,7 +897,7 @@ def display_response(sid):
     # Find the last assistant message
     last_assistant = None
     for msg in reversed(messages):
-        if msg.info.role == "assistant":
+        if msg.role == "assistant":
             last_assistant = msg
             break
 
@@ -160,38 +905,173 @@ def display_response(sid):
         console.print("[dim]No assistant response found.[/dim]")
         return
 
-    # Render error if present
-    if last_assistant.info.error is not None:
-        render_error(last_assistant.info.error)
+    with phase_timer("render", sid):
+        # Render error if present
+        if last_assistant.error is not None:
+            render_error(last_assistant.error)
+
+        # Dispatch each part
+        for part in last_assistant.parts:
+            ptype = part.type
+            if ptype == "text":
+                render_text(part)
+            elif ptype == "tool":
+                render_tool(part)
+            elif ptype == "step-start":
+                render_step_start(part)
+            elif ptype == "step-finish":
+                render_step_finish(part)
+            elif ptype == "reasoning":
+                render_reasoning(part)
+            else:
+                # file, snapshot, patch — show minimal info
+                console.print(f"[dim]  [{ptype}][/dim]")
 
-    # Dispatch each part
-    for part in last_assistant.parts:
-        ptype = part.type
-        if ptype == "text":
-            render_text(part)
-        elif ptype == "tool":
-            render_tool(part)
-        elif ptype == "step-start":
-            render_step_start(part)
-        elif ptype == "step-finish":
-            render_step_finish(part)
-        elif ptype == "reasoning":
-            render_reasoning(part)
+
+def render_key(kind, *content):
+    """Cache key for rendered content: what it is, its hash, and the console it was laid out for."""
+    digest = hashlib.sha1("\0".join(content).encode("utf-8", "surrogatepass")).digest()
+    return (kind, console.width, console.color_system, digest)
+
+
+def print_cached(key, make):
+    """Print `make()`, reusing its rendered segments if `key` was rendered before.
+
+    Rendered output (post-highlighting, post-layout) is kept in an LRU bounded
+    by RENDER_CACHE_BYTES, so repeated code blocks and tool panels cost a
+    lookup instead of a re-lex.
+    """
+    global render_cache_bytes
+    from rich.segment import Segments
+
+    with render_lock:
+        entry = render_cache.get(key)
+        if entry is not None:
+            render_cache.move_to_end(key)
+            render_cache_counts["hits"] += 1
         else:
-            # file, snapshot, patch — show minimal info
-            console.print(f"[dim]  [{ptype}][/dim]")
+            render_cache_counts["misses"] += 1
+    if entry is None:
+        lines = console.render_lines(make(), console.options, new_lines=True)
+        segments = [segment for line in lines for segment in line]
+        # Text plus a rough per-segment overhead (tuple, style reference)
+        size = sum(len(segment.text) for segment in segments) + 80 * len(segments)
+        entry = (segments, size)
+        if size <= RENDER_CACHE_BYTES:
+            with render_lock:
+                if key not in render_cache:
+                    render_cache[key] = entry
+                    render_cache_bytes += size
+                while render_cache_bytes > RENDER_CACHE_BYTES:
+                    _, (_, evicted) = render_cache.popitem(last=False)
+                    render_cache_bytes -= evicted
+    console.print(Segments(entry[0]))
+
+
+_FENCE = re.compile(r"^ {0,3}(`{3,}|~{3,})(.*)$")
+# Lines that may continue a block past a blank line: indented, quote, list item
+_CONTINUES = re.compile(r"^(\s|>|[-*+]\s|\d+[.)]\s)")
+# Blocks that rich.markdown prints with a blank line of their own in front
+_OPENS_BLANK = {"blockquote_open", "bullet_list_open", "ordered_list_open", "table_open"}
+
+
+def markdown_blocks(text):
+    """Split Markdown into blocks in one pass over its lines.
+
+    Yields ("code", lexer, code) for fenced code blocks and ("markdown", None,
+    source) for the prose between them, cut at blank lines into chunks of
+    about MARKDOWN_CHUNK characters. An unclosed fence runs to the end.
+    """
+    prose = []
+    size = 0
+    lines = text.split("\n")
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        fence = _FENCE.match(line)
+        if fence:
+            if prose:
+                yield "markdown", None, "\n".join(prose)
+                prose, size = [], 0
+            marker = fence.group(1)
+            info = fence.group(2).split()
+            code = []
+            i += 1
+            while i < len(lines):
+                closing = lines[i].strip()
+                if closing.startswith(marker) and not closing.strip(marker[0]):
+                    break
+                code.append(lines[i])
+                i += 1
+            i += 1
+            yield "code", info[0] if info else "text", "\n".join(code).rstrip()
+            continue
+        if not line.strip() and size >= MARKDOWN_CHUNK:
+            yield "markdown", None, "\n".join(prose)
+            prose, size = [], 0
+        elif prose or line.strip():
+            prose.append(line)
+            size += len(line) + 1
+        i += 1
+    if any(line.strip() for line in prose):
+        yield "markdown", None, "\n".join(prose)
+
+
+def render_markdown(text, layout=None):
+    """Print Markdown block by block, so output starts before the whole text is parsed.
+
+    Fenced code is highlighted as rich.markdown would, until HIGHLIGHT_BUDGET
+    characters of code have been highlighted in this call; code blocks past
+    the budget (or larger than it) are printed without highlighting. Code
+    blocks seen before come from the render cache and cost no budget.
+
+    A text rendered in pieces (as it streams) passes the same ``layout``
+    dict to each call, which carries the spacing and the budget over.
+    """
+    from rich.markdown import Markdown
+    from rich.syntax import Syntax
+
+    if layout is None:
+        layout = {}
+    budget = layout.get("budget", HIGHLIGHT_BUDGET)
+    previous = layout.get("previous")
+    for kind, lexer, source in markdown_blocks(text):
+        markdown = Markdown(source) if kind == "markdown" else None
+        tokens = markdown.parsed if markdown is not None else []
+        # Same spacing as one Markdown(): a blank line between any two blocks, which
+        # a rule already prints after itself and lists, quotes and tables before
+        if previous not in (None, "rule") and not (tokens and tokens[0].type in _OPENS_BLANK):
+            console.print()
+        previous = "rule" if tokens and tokens[-1].type == "hr" else kind
+        if markdown is not None:
+            console.print(markdown)
+            continue
+        key = render_key("code", lexer, source)
+        if key not in render_cache:
+            # Only code that actually gets lexed counts against the budget
+            if len(source) <= budget:
+                budget -= len(source)
+            else:
+                lexer = "text"
+                key = render_key("code", lexer, source)
+        print_cached(
+            key, lambda: Syntax(source, lexer, theme="monokai", word_wrap=True, padding=1)
+        )
+    layout["budget"] = budget
+    layout["previous"] = previous
 
 
 def render_text(part):
     """Render a text part as rich markdown."""
     if part.text:
         console.print()
-        console.print(Markdown(part.text))
+        render_markdown(part.text)
         console.print()
 
 
 def render_tool(part):
     """Render a tool call as a rich panel."""
+    from rich.panel import Panel
     state = part.state
     status = state.status
 
@@ -226,11 +1106,15 @@ def render_tool(part):
         except Exception:
             pass
 
-    # Output (completed only)
+    # Output (completed only); large ones may live in a spill file
     output = getattr(state, "output", None)
     if output:
-        truncated = output if len(output) <= 500 else output[:500] + "..."
-        lines.append(f"[dim]Output:[/dim] {truncated}")
+        size = spilled[part.id][1] if part.id in spilled else len(output)
+        if size <= TOOL_PREVIEW:
+            lines.append(f"[dim]Output:[/dim] {output}")
+        else:
+            lines.append(f"[dim]Output:[/dim] {output[:TOOL_PREVIEW]}...")
+            lines.append(f"[dim]({size:,} characters; /output {part.id} shows all)[/dim]")
 
     # Error message (error state)
     error_msg = getattr(state, "error", None)
@@ -238,7 +1122,10 @@ def render_tool(part):
         lines.append(f"[red]Error: {error_msg}[/red]")
 
     content = "\n".join(lines)
-    console.print(Panel(content, title=f"Tool: {part.tool}", border_style="cyan"))
+    print_cached(
+        render_key("tool", part.tool, content),
+        lambda: Panel(content, title=f"Tool: {part.tool}", border_style="cyan"),
+    )
 
 
 def render_step_start(part):
@@ -259,6 +1146,7 @@ def render_step_finish(part):
 
 def render_reasoning(part):
     """Render a reasoning/thinking part."""
+    from rich.panel import Panel
     text = getattr(part, "text", None)
     if text:
         truncated = text if len(text) <= 300 else text[:300] + "..."
@@ -267,6 +1155,7 @@ def render_reasoning(part):
 
 def render_error(error):
     """Render an assistant-level error."""
+    from rich.panel import Panel
     name = getattr(error, "name", "Error")
     data = getattr(error, "data", None)
 
@@ -286,24 +1175,508 @@ def render_error(error):
         console.print(Panel(f"[red]{name}: {msg}[/red]", border_style="red"))
 
 
+def render_tool_status(part):
+    """Render a one-line tool state transition (pending/running)."""
+    status = part.state.status
+    title_str = getattr(part.state, "title", None)
+    suffix = f" [dim]— {title_str}[/dim]" if title_str else ""
+    if status == "running":
+        console.print(f"  [yellow]⏳ {part.tool} running[/yellow]{suffix}")
+    else:
+        console.print(f"  [dim]⏳ {part.tool} {status}[/dim]{suffix}")
+
+
+class StreamRenderer:
+    """Render server events for one session as they arrive.
+
+    Events are the SDK's parsed ``/event`` payloads. Only parts belonging to
+    assistant messages of ``sid`` are rendered; text is rendered as Markdown
+    a block at a time, as each paragraph or fenced code block completes,
+    tools on every state transition, steps once each.
+    """
+
+    def __init__(self, sid):
+        self.sid = sid
+        self.assistant_ids = set()
+        self.text_state = {}    # part id -> [rendered, scanned, open fence, after blank line]
+        self.text_part = None   # id of the text part with unrendered text, if any
+        self.text = ""          # its latest text
+        self.layout = {}        # render_markdown() spacing and budget for this turn
+        self.tool_status = {}   # part id -> last rendered tool status
+        self.done_parts = set() # step/reasoning part ids already rendered
+        self.reasoning = {}     # part id -> latest unfinished reasoning part
+        self.errors = set()     # message ids whose error was rendered
+        self.in_text = False
+        self.rendered = False
+        self.idle = False
+
+    def handle(self, event):
+        """Dispatch a single event."""
+        etype = getattr(event, "type", None)
+        props = getattr(event, "properties", None)
+        if props is None:
+            return
+
+        if etype == "message.updated":
+            info = getattr(props, "info", None)
+            if info is None or getattr(info, "session_id", None) != self.sid:
+                return
+            if getattr(info, "role", None) != "assistant":
+                return
+            self.assistant_ids.add(info.id)
+            error = getattr(info, "error", None)
+            if error is not None and info.id not in self.errors:
+                self.errors.add(info.id)
+                self._end_text()
+                render_error(error)
+                self.rendered = True
+
+        elif etype == "message.part.updated":
+            part = getattr(props, "part", None)
+            if part is None or getattr(part, "session_id", None) != self.sid:
+                return
+            if getattr(part, "message_id", None) not in self.assistant_ids:
+                return
+            self.on_part(part)
+
+        elif etype == "session.idle":
+            if getattr(props, "session_id", None) == self.sid:
+                self.idle = True
+
+    def on_part(self, part):
+        """Render whatever is new about a part since we last saw it."""
+        ptype = part.type
+        if ptype == "text":
+            if part.id != self.text_part:
+                self._end_text()
+                self.text_part = part.id
+                self.text_state.setdefault(part.id, [0, 0, None, False])
+            self.text = getattr(part, "text", None) or ""
+            self._render_text(getattr(getattr(part, "time", None), "end", None) is not None)
+            return
+
+        if ptype == "reasoning":
+            if getattr(getattr(part, "time", None), "end", None) is None:
+                self.reasoning[part.id] = part
+                return
+            self.reasoning.pop(part.id, None)
+
+        if ptype == "tool":
+            status = part.state.status
+            if self.tool_status.get(part.id) == status:
+                return
+            self.tool_status[part.id] = status
+            self._end_text()
+            if status in ("completed", "error"):
+                # The panel offers /output for long outputs; spill them now so
+                # that works without waiting on (or having) the store
+                output = getattr(part.state, "output", None) or ""
+                if len(output) > TOOL_PREVIEW and part.id not in spilled:
+                    spill_output(part.id, output)
+                render_tool(part)
+            else:
+                render_tool_status(part)
+            self.rendered = True
+            return
+
+        if part.id in self.done_parts:
+            return
+        self.done_parts.add(part.id)
+        self._end_text()
+        if ptype == "step-start":
+            render_step_start(part)
+        elif ptype == "step-finish":
+            render_step_finish(part)
+        elif ptype == "reasoning":
+            render_reasoning(part)
+        else:
+            console.print(f"[dim]  [{ptype}][/dim]")
+        self.rendered = True
+
+    def catch_up(self, messages):
+        """Render what the stream did not deliver of the turn, from fetched `messages`.
+
+        The turn is everything after the last user message; parts already
+        rendered are skipped as usual, and a half-rendered text part resumes.
+        """
+        turn = []
+        for msg in reversed(messages):
+            if msg.role == "user":
+                break
+            turn.append(msg)
+        for msg in reversed(turn):
+            if msg.role != "assistant":
+                continue
+            self.assistant_ids.add(msg.id)
+            for part in msg.parts:
+                self.on_part(part)
+            if msg.error is not None and msg.id not in self.errors:
+                self.errors.add(msg.id)
+                self._end_text()
+                render_error(msg.error)
+                self.rendered = True
+
+    def finish(self):
+        """Flush anything still pending at the end of a turn."""
+        for part in list(self.reasoning.values()):
+            self.done_parts.add(part.id)
+            self._end_text()
+            render_reasoning(part)
+        self.reasoning.clear()
+        self._end_text()
+
+    def _render_text(self, final):
+        """Render the finished blocks of the current text part (all of it if `final`).
+
+        Lines are scanned once each. A block ends at a closing fence, before
+        an opening fence, and before a line that starts a new paragraph after
+        a blank line; list items, quotes and indented lines after a blank line
+        stay with the block they continue, as one Markdown() would lay them out.
+        """
+        state = self.text_state[self.text_part]
+        cut, pos, fence, blank = state
+        text = self.text
+        if final:
+            cut = pos = len(text)
+        else:
+            while True:
+                newline = text.find("\n", pos)
+                if newline < 0:
+                    break
+                line = text[pos:newline]
+                opening = None if fence else _FENCE.match(line)
+                if fence:
+                    closing = line.strip()
+                    if closing.startswith(fence) and not closing.strip(fence[0]):
+                        fence = None
+                        cut = newline + 1
+                elif opening:
+                    fence = opening.group(1)
+                    cut = pos
+                    blank = False
+                elif not line.strip():
+                    blank = True
+                else:
+                    if blank and not _CONTINUES.match(line):
+                        cut = pos
+                    blank = False
+                pos = newline + 1
+        chunk = text[state[0]:cut]
+        state[:] = [cut, pos, fence, blank]
+        if chunk.strip():
+            if not self.in_text:
+                console.print()
+                self.in_text = True
+            render_markdown(chunk, self.layout)
+            self.rendered = True
+
+    def _end_text(self):
+        if self.text_part is not None:
+            self._render_text(True)
+            self.text_part = None
+        if self.in_text:
+            console.print()
+            self.in_text = False
+            self.layout["previous"] = None
+
+
 # ---------------------------------------------------------------------------
 # Section D: REPL & commands
 # ---------------------------------------------------------------------------
 
 
-def send_message(text):
-    """Send a message to the current session and display the response."""
-    global session_id
+_CHAT_DONE = object()
+_STREAM_CLOSED = object()
+
+
+def _pump_events(stream, events):
+    """Reader thread: forward SSE events into a queue until the stream ends."""
     try:
-        console.print("[dim]Thinking...[/dim]")
+        for event in stream:
+            events.put(event)
+    except Exception:
+        pass
+    finally:
+        events.put(_STREAM_CLOSED)
+
+
+def _run_chat(sid, text, events):
+    """Worker thread: run the blocking chat call and report its outcome."""
+    try:
+        with phase_timer("chat", sid):
+            client.session.chat(
+                sid,
+                model_id=model_id,
+                provider_id=provider_id,
+                parts=[{"type": "text", "text": text}],
+                timeout=300,
+            )
+        events.put((_CHAT_DONE, None))
+    except Exception as e:
+        events.put((_CHAT_DONE, e))
+
+
+def poll_response(sid, text, guard=None):
+    """Send a message, block until the turn completes, then render it."""
+    if guard is not None:
+        guard.watch()
+    with phase_timer("chat", sid):
         client.session.chat(
-            session_id,
+            sid,
             model_id=model_id,
             provider_id=provider_id,
             parts=[{"type": "text", "text": text}],
             timeout=300,
         )
-        display_response(session_id)
+    display_response(sid)
+
+
+def stream_response(sid, text, guard=None):
+    """Send a message and render the response live from the event stream.
+
+    The event stream is opened before the chat request is sent so no early
+    events are missed. The chat call runs in a worker thread; the main thread
+    renders events until the session goes idle (or the chat call returns and
+    the stream falls quiet for STREAM_GRACE seconds). A `guard` sees the same
+    events.
+    """
+    try:
+        stream = client.event.list(timeout=httpx.Timeout(None, connect=5.0))
+    except Exception:
+        poll_response(sid, text, guard)
+        return
+
+    events = queue.Queue()
+    renderer = StreamRenderer(sid)
+    started = time.perf_counter()
+    threading.Thread(target=_pump_events, args=(stream, events), daemon=True).start()
+    threading.Thread(target=_run_chat, args=(sid, text, events), daemon=True).start()
+
+    chat_error = None
+    deadline = None
+    stream_open = True
+    caught_up = False
+    render_time = 0.0
+    try:
+        while True:
+            try:
+                item = events.get(timeout=0.1)
+            except queue.Empty:
+                if deadline is not None and time.monotonic() > deadline:
+                    break
+                continue
+
+            if item is _STREAM_CLOSED:
+                stream_open = False
+                if deadline is not None:
+                    break
+            elif isinstance(item, tuple) and item[0] is _CHAT_DONE:
+                chat_error = item[1]
+                if renderer.idle or not stream_open:
+                    break
+                deadline = time.monotonic() + STREAM_GRACE
+            else:
+                if guard is not None:
+                    guard.handle(item)
+                seen_output = renderer.rendered
+                handle_started = time.perf_counter()
+                renderer.handle(item)
+                render_time += time.perf_counter() - handle_started
+                if renderer.rendered and not seen_output:
+                    record_timing("first_output", time.perf_counter() - started, sid)
+                if renderer.idle and deadline is not None:
+                    break
+        if chat_error is None and renderer.rendered and not renderer.idle:
+            # The stream closed or went quiet before the session went idle:
+            # show the rest of the turn from the server (which also stores it)
+            try:
+                renderer.catch_up(fetch_messages(sid))
+                caught_up = True
+            except Exception as e:
+                console.print(f"[bold red]Error fetching messages:[/] {e}")
+    finally:
+        renderer.finish()
+        stream.close()
+        if renderer.rendered:
+            record_timing("render", render_time, sid)
+
+    if chat_error is not None:
+        raise chat_error
+    if not renderer.rendered:
+        # Server sent no usable events (old server or stream dropped)
+        display_response(sid)
+    elif not caught_up:
+        persist_turn(sid)
+
+
+def _cap_text(kind, value):
+    """A cap or usage value with its unit."""
+    if kind == "cost":
+        return f"${value:.4f}"
+    if kind == "seconds":
+        return f"{value:.1f}s"
+    unit = "tokens" if kind == "tokens" else "tool calls" if int(value) != 1 else "tool call"
+    return f"{int(value):,} {unit}"
+
+
+class TurnGuard:
+    """Hard caps for one turn: counts the turn's tokens, cost and tool calls from
+    its events and aborts it (client.session.abort) once a turn or session cap
+    is exceeded.
+
+    Streaming paths pass it the events they already receive (handle()); the
+    others call watch(), which reads the event stream in a thread. The
+    wall-clock cap is a timer, so it holds even while no events arrive.
+    Session caps add the session's earlier usage from the transcript store.
+    """
+
+    def __init__(self, sid, report):
+        self.sid = sid
+        self.report = report
+        self.assistant_ids = set()
+        self.counted = set()  # step-finish and tool part ids already counted
+        self.usage = dict.fromkeys(CAP_KINDS, 0)
+        self.before = dict.fromkeys(CAP_KINDS, 0)
+        if any(session_caps.values()):
+            self.before = load_session_usage(sid)
+        self.started = time.monotonic()
+        self.lock = threading.Lock()
+        self.stream = None
+        self.timer = None
+        self.reason = self._exceeded()  # set: the session is over a cap already
+
+    def start(self):
+        """Arm the wall-clock cap."""
+        limits = [turn_caps["seconds"]]
+        if session_caps["seconds"]:
+            limits.append(session_caps["seconds"] - self.before["seconds"])
+        limits = [limit for limit in limits if limit]
+        if limits:
+            self.timer = threading.Timer(max(0.0, min(limits)) + 0.05, self.check)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def watch(self):
+        """Follow the event stream in a thread (for turns nothing else streams)."""
+        evented = ("tokens", "cost", "tools")
+        if not any(caps[kind] for caps in (turn_caps, session_caps) for kind in evented):
+            return
+        try:
+            self.stream = client.event.list(timeout=httpx.Timeout(None, connect=5.0))
+        except Exception:
+            return
+        threading.Thread(target=self._follow, daemon=True).start()
+
+    def _follow(self):
+        try:
+            for event in self.stream:
+                self.handle(event)
+        except Exception:
+            pass
+
+    def handle(self, event):
+        """Count a finished step or a new tool call of this session's turn."""
+        etype = getattr(event, "type", None)
+        props = getattr(event, "properties", None)
+        if etype == "message.updated":
+            info = getattr(props, "info", None)
+            if getattr(info, "session_id", None) != self.sid:
+                return
+            if getattr(info, "role", None) == "assistant":
+                self.assistant_ids.add(info.id)
+            return
+        if etype != "message.part.updated":
+            return
+        part = getattr(props, "part", None)
+        if getattr(part, "message_id", None) not in self.assistant_ids or part.id in self.counted:
+            return
+        if part.type == "step-finish":
+            tokens = part.tokens
+            used = (tokens.input or 0) + (tokens.output or 0) + (tokens.reasoning or 0)
+            self.usage["tokens"] += int(used)
+            self.usage["cost"] += part.cost or 0
+        elif part.type == "tool":
+            self.usage["tools"] += 1
+        else:
+            return
+        self.counted.add(part.id)
+        self.check()
+
+    def _exceeded(self):
+        """Why a cap is exceeded, or None."""
+        self.usage["seconds"] = time.monotonic() - self.started
+        scopes = (("turn", turn_caps, None), ("session", session_caps, self.before))
+        for scope, caps, before in scopes:
+            for kind in CAP_KINDS:
+                used = self.usage[kind] + (before[kind] if before else 0)
+                if caps[kind] and used > caps[kind]:
+                    limit = _cap_text(kind, caps[kind])
+                    return f"{scope} {kind} cap of {limit} exceeded ({_cap_text(kind, used)})"
+        return None
+
+    def check(self):
+        """Abort the turn if a cap is exceeded (once)."""
+        with self.lock:
+            if self.reason is not None:
+                return
+            self.reason = self._exceeded()
+            if self.reason is None:
+                return
+        try:
+            client.session.abort(self.sid)
+        except Exception:
+            pass
+        self.report(f"[bold red]Aborted the turn in {self.sid[:8]}...: {self.reason}.[/bold red]")
+
+    def close(self):
+        """Stop the timer and the event stream at the end of the turn."""
+        if self.timer is not None:
+            self.timer.cancel()
+        if self.stream is not None:
+            try:
+                self.stream.close()
+            except Exception:
+                pass
+
+
+def turn_guard(sid, report=None):
+    """A started TurnGuard for a turn in `sid`, or None if no cap is set.
+
+    If the session is already over a cap, the guard's `reason` is set and the
+    turn should not be sent.
+    """
+    if not any(turn_caps.values()) and not any(session_caps.values()):
+        return None
+    guard = TurnGuard(sid, report or console.print)
+    if guard.reason is None:
+        guard.start()
+    return guard
+
+
+def send_message(text):
+    """Send a message to the current session and display the response."""
+    from opencode_ai import APIConnectionError, APIStatusError
+    global session_id
+    if session_busy(session_id):
+        console.print(
+            "[yellow]A background turn is running in this session; "
+            "/switch to another or /abort it.[/yellow]"
+        )
+        return
+    guard = turn_guard(session_id)
+    if guard is not None and guard.reason:
+        console.print(
+            f"[bold red]Not sent: {guard.reason}.[/bold red] [dim]/caps changes the caps.[/dim]"
+        )
+        return
+    drop_prefetched_sessions()
+    try:
+        console.print("[dim]Thinking...[/dim]")
+        with phase_timer("turn", session_id):
+            if stream_enabled:
+                stream_response(session_id, text, guard)
+            else:
+                poll_response(session_id, text, guard)
 
     except KeyboardInterrupt:
         console.print("\n[yellow]Aborting...[/yellow]")
@@ -311,8 +1684,9 @@ def send_message(text):
             client.session.abort(session_id)
         except Exception:
             pass
-        # Show whatever partial response exists
-        display_response(session_id)
+        # Show whatever partial response exists (streaming already showed it)
+        if not stream_enabled:
+            display_response(session_id)
 
     except APIConnectionError:
         console.print("[bold red]Lost connection to OpenCode server.[/bold red]")
@@ -323,49 +1697,442 @@ def send_message(text):
     except Exception as e:
         console.print(f"[bold red]Error:[/] {e}")
 
+    finally:
+        if guard is not None:
+            guard.close()
+
+
+def fill_session_pool(size=None):
+    """Top the warm session pool up to `size` (default SESSION_POOL_SIZE) in the background."""
+    global session_pool_pending, session_pool_used
+    size = SESSION_POOL_SIZE if size is None else size
+    with session_pool_lock:
+        if session_pool_closed:
+            return
+        missing = size - len(session_pool) - session_pool_pending
+        if missing <= 0:
+            return
+        if not session_pool_used:
+            # Registered after the pool and server cleanups, so it runs before them
+            atexit.register(drain_session_pool)
+            session_pool_used = True
+        session_pool_pending += missing
+    for _ in range(missing):
+        threading.Thread(target=_add_pooled_session, daemon=True).start()
+
+
+def _add_pooled_session():
+    """Create one session for the pool (deleting it if the pool closed meanwhile)."""
+    global session_pool_pending
+    try:
+        session = _new_remote_session()
+    except Exception:
+        session = None
+    with session_pool_lock:
+        if session is not None and not session_pool_closed:
+            session_pool.append(session)
+            session = None
+    if session is not None:
+        _delete_session(session.id)
+    with session_pool_lock:
+        session_pool_pending -= 1
+        session_pool_settled.notify_all()
+
+
+def pop_pooled_session():
+    """A warm session from the pool, or None if it is empty."""
+    with session_pool_lock:
+        return session_pool.popleft() if session_pool else None
+
+
+def take_session():
+    """A fresh session: a warm one from the pool if any, else created now. Refills the pool."""
+    session = pop_pooled_session() or _new_remote_session()
+    fill_session_pool()
+    return session
+
+
+def pooled_ids():
+    """IDs of the warm sessions, which are hidden from session lists."""
+    with session_pool_lock:
+        return {session.id for session in session_pool}
+
+
+def _delete_session(sid):
+    """DELETE /session/{id}, ignoring errors."""
+    try:
+        client.session.delete(sid)
+    except Exception:
+        pass
+
+
+def drain_session_pool():
+    """Delete the warm sessions nobody used (on exit; idempotent).
+
+    Creations still in flight delete their session when it arrives; this
+    waits (up to SESSION_POOL_DRAIN) for them, since their threads die with
+    the process.
+    """
+    global session_pool_closed
+    with session_pool_lock:
+        session_pool_closed = True
+        unused = list(session_pool)
+        session_pool.clear()
+    for session in unused:
+        _delete_session(session.id)
+    with session_pool_lock:
+        session_pool_settled.wait_for(lambda: session_pool_pending == 0, SESSION_POOL_DRAIN)
+
 
 def create_session():
-    """Create a new chat session."""
+    """Create a new chat session (taken from the warm pool when possible)."""
     global session_id
     try:
-        session = client.session.create(extra_body={})
+        session = take_session()
         session_id = session.id
+        attach_session(session)
+        drop_prefetched_sessions()
+        store_sessions([session])
         console.print(f"[dim]Session: {session_id[:8]}...[/dim]")
     except Exception as e:
         console.print(f"[bold red]Error creating session:[/] {e}")
         sys.exit(1)
 
 
-def handle_command(cmd):
-    """Handle a slash command."""
-    raw = cmd.strip()
-    cmd = raw.lower()
+def attach_session(session):
+    """Add a session to the workspace (if not attached yet); return its entry."""
+    return workspace.setdefault(
+        session.id, {"title": getattr(session, "title", None) or "", "turn": None, "unseen": False}
+    )
 
-    if cmd in ("/quit", "/exit"):
-        console.print("Goodbye!")
-        cleanup_opencode()
-        sys.exit(0)
 
-    elif cmd == "/new":
-        create_session()
-        console.print("[green]New session created.[/green]")
+def session_busy(sid):
+    """True while a background turn is running in `sid`."""
+    turn = workspace.get(sid, {}).get("turn")
+    return turn is not None and turn.is_alive()
 
-    elif cmd == "/history":
-        show_history()
 
-    elif cmd == "/sessions":
-        list_sessions()
+def _session_index():
+    """The session prefix index, built from the transcript store on first use.
 
-    elif cmd == "/models":
-        show_models()
+    Caller holds session_index_lock. Sorted lists make a prefix a contiguous
+    range found by bisection, so lookups stay instant with thousands of
+    sessions; store_sessions() keeps it current one session at a time.
+    """
+    global session_index
+    if session_index is None:
+        session_index = {"ids": [], "titles": [], "title": {}}
+        _index_add(load_sessions())
+    return session_index
 
-    elif cmd.startswith("/model "):
+
+def _index_add(sessions):
+    """Insert or retitle sessions in the index (caller holds session_index_lock)."""
+    ids, titles, title_of = session_index["ids"], session_index["titles"], session_index["title"]
+    new_ids, new_titles = [], []
+    for s in sessions:
+        title = getattr(s, "title", None) or ""
+        old = title_of.get(s.id)
+        if old == title:
+            continue
+        if old is None:
+            new_ids.append(s.id)
+        else:
+            del titles[bisect.bisect_left(titles, (old.casefold(), s.id))]
+        title_of[s.id] = title
+        new_titles.append((title.casefold(), s.id))
+    for keys, new in ((ids, new_ids), (titles, new_titles)):
+        if len(new) > 32:
+            keys.extend(new)
+            keys.sort()
+        else:
+            for key in new:
+                bisect.insort(keys, key)
+
+
+def _prefix_range(keys, low, high):
+    """keys[i:j] for the sorted `keys` between `low` and `high`."""
+    return keys[bisect.bisect_left(keys, low):bisect.bisect_left(keys, high)]
+
+
+def index_sessions(sessions):
+    """Add sessions (SDK or store objects) to the prefix index."""
+    with session_index_lock:
+        _session_index()
+        _index_add(sessions)
+
+
+def lookup_sessions(prefix):
+    """Indexed sessions whose ID starts with `prefix` (an exact ID wins), else those
+    whose title starts with it (case-insensitive)."""
+    with session_index_lock:
+        index = _session_index()
+        if prefix in index["title"]:
+            hits = [prefix]
+        else:
+            hits = _prefix_range(index["ids"], prefix, prefix + "\U0010ffff")
+        if not hits:
+            folded = prefix.casefold()
+            titles = _prefix_range(index["titles"], (folded,), (folded + "\U0010ffff",))
+            hits = [sid for _, sid in titles]
+        hidden = pooled_ids()
+        return [
+            types.SimpleNamespace(id=sid, title=index["title"][sid])
+            for sid in hits if sid not in hidden
+        ]
+
+
+def short_id(sid, minimum=8):
+    """Shortest prefix of `sid` (at least `minimum` characters) no other indexed ID shares."""
+    with session_index_lock:
+        ids = _session_index()["ids"]
+        at = bisect.bisect_left(ids, sid)
+        shared = 0
+        for other in ids[max(0, at - 1):at + 2]:
+            if other != sid:
+                shared = max(shared, len(os.path.commonprefix([sid, other])))
+    return sid[:max(minimum, shared + 1)]
+
+
+def find_sessions(prefix):
+    """Sessions `prefix` names, from the index; a miss refreshes it from the server."""
+    matches = lookup_sessions(prefix)
+    if not matches and client is not None:
+        hidden = pooled_ids()
+        store_sessions([s for s in client.session.list() if s.id not in hidden])
+        matches = lookup_sessions(prefix)
+    return matches
+
+
+def resolve_session(prefix):
+    """The one session `prefix` names; ValueError if none or several match."""
+    matches = find_sessions(prefix)
+    if not matches:
+        raise ValueError(f"No session matches '{prefix}'.")
+    if len(matches) > 1:
+        listing = ", ".join(f"{s.id} ({s.title or 'untitled'})" for s in matches[:5])
+        more = f" and {len(matches) - 5} more" if len(matches) > 5 else ""
+        raise ValueError(f"'{prefix}' matches several sessions: {listing}{more}")
+    return matches[0]
+
+
+def switch_session(prefix, show_last=False):
+    """Make the session `prefix` names current, attaching it if needed.
+
+    A background turn that finished there since it was last viewed is shown;
+    `show_last` (/resume) shows the last response in any case.
+    """
+    global session_id
+    try:
+        session = resolve_session(prefix)
+    except ValueError as e:
+        console.print(f"[red]{escape(str(e))}[/red]")
+        return
+    except Exception as e:
+        console.print(f"[bold red]Error:[/] {e}")
+        return
+
+    entry = attach_session(session)
+    session_id = session.id
+    drop_prefetched_sessions()
+    title = f" ({escape(entry['title'])})" if entry["title"] else ""
+    verb = "Resumed" if show_last else "Switched to"
+    console.print(f"[green]{verb} {short_id(session_id)}{title}[/green]")
+    if session_busy(session_id):
+        console.print("[dim]A background turn is still running here.[/dim]")
+    elif entry["unseen"] or show_last:
+        entry["unseen"] = False
+        display_response(session_id)
+
+
+def show_workspace():
+    """List the attached sessions and the state of their background turns."""
+    from rich.table import Table
+    table = Table(title="Workspace")
+    table.add_column("ID", style="cyan")
+    table.add_column("Title", style="white")
+    table.add_column("State")
+    table.add_column("Active", style="green")
+    for sid, entry in workspace.items():
+        if session_busy(sid):
+            elapsed = time.monotonic() - entry["started"]
+            state = f"[yellow]running {elapsed:.0f}s[/yellow]"
+        elif entry["unseen"]:
+            state = "[green]finished (unread)[/green]"
+        else:
+            state = "[dim]idle[/dim]"
+        active = "→" if sid == session_id else ""
+        table.add_row(short_id(sid), escape(entry["title"] or "(untitled)"), state, active)
+    console.print(table)
+    console.print(
+        "[dim]/switch <id> attaches or switches; "
+        "/bg <message> runs a turn in the background.[/dim]"
+    )
+
+
+def notify(text):
+    """Show a notice now if the REPL is idle at its prompt, else at the next prompt."""
+    with notify_lock:
+        if prompt_waiting.is_set():
+            console.print(f"\n{text}")
+            console.print("[bold green]You>[/] ", end="")
+        else:
+            notifications.append(text)
+
+
+def flush_notifications():
+    """Print the notices queued while a turn or command was running."""
+    with notify_lock:
+        while notifications:
+            console.print(notifications.popleft())
+
+
+def _background_turn(sid, text, model, guard):
+    """Worker thread: run a turn without rendering it, then post a completion notice."""
+    from opencode_ai import APIStatusError
+    entry = workspace[sid]
+    label = f"{sid[:8]}..." + (f" ({escape(entry['title'])})" if entry["title"] else "")
+    if guard is not None:
+        guard.watch()
+    try:
+        with phase_timer("turn", sid):
+            with phase_timer("chat", sid):
+                client.session.chat(
+                    sid,
+                    model_id=model[1],
+                    provider_id=model[0],
+                    parts=[{"type": "text", "text": text}],
+                    timeout=300,
+                )
+            messages = fetch_messages(sid)
+    except APIStatusError as e:
+        note = (
+            f"[red]Background turn in {label} failed: "
+            f"API error ({e.status_code}) {e.message}[/red]"
+        )
+    except Exception as e:
+        note = f"[red]Background turn in {label} failed: {escape(str(e))}[/red]"
+    else:
+        users = [i for i, msg in enumerate(messages) if msg.role == "user"]
+        summary = summarize_turn(messages[users[-1] + 1:] if users else messages)
+        tokens = summary["tokens"]["input"] + summary["tokens"]["output"]
+        status = f"failed ({escape(summary['error'])})" if summary["error"] else "finished"
+        note = (
+            f"[green]●[/green] Background turn in {label} {status}: "
+            f"{tokens} tokens, ${summary['cost']:.4f}. [dim]/switch {sid} to read it[/dim]"
+        )
+    finally:
+        if guard is not None:
+            guard.close()
+    entry["unseen"] = True
+    entry["turn"] = None
+    notify(note)
+
+
+def start_background_turn(text):
+    """Send `text` to the current session and let the turn run in the background."""
+    if not text:
+        console.print("[dim]Usage: /bg <message>[/dim]")
+        return
+    entry = workspace.setdefault(session_id, {"title": "", "turn": None, "unseen": False})
+    if session_busy(session_id):
+        console.print("[yellow]A background turn is already running in this session.[/yellow]")
+        return
+    guard = turn_guard(session_id, notify)
+    if guard is not None and guard.reason:
+        console.print(
+            f"[bold red]Not sent: {guard.reason}.[/bold red] [dim]/caps changes the caps.[/dim]"
+        )
+        return
+    drop_prefetched_sessions()
+    entry["turn"] = threading.Thread(
+        target=_background_turn,
+        args=(session_id, text, (provider_id, model_id), guard),
+        daemon=True,
+    )
+    entry["started"] = time.monotonic()
+    entry["unseen"] = False
+    entry["turn"].start()
+    console.print(
+        f"[dim]Running in the background in {session_id[:8]}...; "
+        "/new or /switch <id> to keep working elsewhere.[/dim]"
+    )
+
+
+def report_background_turns():
+    """On exit: say which background turns are still running (they finish server-side)."""
+    running = [sid for sid in workspace if session_busy(sid)]
+    if running:
+        ids = ", ".join(sid[:8] + "..." for sid in running)
+        console.print(f"[dim]Background turns still running on the server in: {ids}[/dim]")
+
+
+def handle_command(cmd):
+    """Handle a slash command."""
+    raw = cmd.strip()
+    cmd = raw.lower()
+
+    if cmd in ("/quit", "/exit"):
+        console.print("Goodbye!")
+        report_background_turns()
+        drain_session_pool()
+        cleanup_opencode()
+        sys.exit(0)
+
+    elif cmd == "/new":
+        create_session()
+        console.print("[green]New session created.[/green]")
+
+    elif cmd == "/history" or cmd.startswith("/history "):
+        try:
+            options = parse_history_args(raw[8:])
+        except ValueError as e:
+            console.print(f"[red]{escape(str(e))}[/red]")
+            console.print(
+                "[dim]Usage: /history \\[page] \\[--last N] \\[--since TIME] \\[--local][/dim]"
+            )
+        else:
+            show_history(**options)
+
+    elif cmd == "/switch":
+        show_workspace()
+
+    elif cmd.startswith("/switch "):
+        switch_session(raw[8:].strip())
+
+    elif cmd == "/resume":
+        console.print("[dim]Usage: /resume <id or title prefix>[/dim]")
+
+    elif cmd.startswith("/resume "):
+        switch_session(raw[8:].strip(), show_last=True)
+
+    elif cmd == "/bg" or cmd.startswith("/bg "):
+        start_background_turn(raw[3:].strip())
+
+    elif cmd == "/sessions" or cmd.startswith("/sessions "):
+        try:
+            options = parse_sessions_args(raw[9:])
+        except ValueError as e:
+            console.print(f"[red]{escape(str(e))}[/red]")
+            console.print(
+                "[dim]Usage: /sessions \\[filter] \\[--limit N] \\[--offset N] \\[--local][/dim]"
+            )
+        else:
+            list_sessions(**options)
+
+    elif cmd == "/models" or cmd.startswith("/models "):
+        show_models(refresh=cmd[7:].strip() == "--refresh")
+
+    elif cmd.startswith("/model "):
         switch_model(raw[7:].strip())
 
     elif cmd == "/model":
         console.print(f"[bold]Current:[/] {provider_id}/{model_id}")
         console.print("[dim]Usage: /model <provider>/<model_id>[/dim]")
 
+    elif cmd == "/stream" or cmd.startswith("/stream "):
+        set_streaming(cmd[7:].strip())
+
     elif cmd == "/abort":
         try:
             client.session.abort(session_id)
@@ -373,6 +2140,21 @@ def handle_command(cmd):
         except Exception as e:
             console.print(f"[red]Abort failed:[/] {e}")
 
+    elif cmd == "/stats" or cmd.startswith("/stats "):
+        show_stats(raw[6:].strip())
+
+    elif cmd == "/cost" or cmd.startswith("/cost "):
+        show_cost(cmd[5:].strip())
+
+    elif cmd == "/caps" or cmd.startswith("/caps "):
+        set_caps(cmd[5:].strip())
+
+    elif cmd == "/output" or cmd.startswith("/output "):
+        show_output(raw[7:].strip())
+
+    elif cmd == "/search" or cmd.startswith("/search "):
+        search_sessions(raw[7:].strip())
+
     elif cmd == "/help":
         show_help()
 
@@ -380,20 +2162,117 @@ def handle_command(cmd):
         console.print(f"[red]Unknown command:[/] {cmd}. Type /help for commands.")
 
 
-def show_history():
-    """Display all messages in the current session."""
+def parse_since(text):
+    """Epoch ms for a `--since` value: 90m, 2h, 3d, 1w, HH:MM (today) or an ISO date/time."""
+    match = re.fullmatch(r"(\d+)([smhdw])", text)
+    if match:
+        unit = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}[match.group(2)]
+        return int((time.time() - int(match.group(1)) * unit) * 1000)
     try:
-        messages = client.session.messages(session_id)
-    except Exception as e:
-        console.print(f"[bold red]Error:[/] {e}")
-        return
-
-    if not messages:
-        console.print("[dim]No messages yet.[/dim]")
+        if re.fullmatch(r"\d{1,2}:\d{2}", text):
+            clock = datetime.datetime.strptime(text, "%H:%M").time()
+            moment = datetime.datetime.combine(datetime.date.today(), clock)
+        else:
+            moment = datetime.datetime.fromisoformat(text)
+    except ValueError:
+        raise ValueError(f"Unrecognized time '{text}' (try 30m, 2h, 1d, 14:30 or 2024-05-01)")
+    return int(moment.timestamp() * 1000)
+
+
+def parse_history_args(arg):
+    """Parse `/history` arguments into show_history() keyword arguments."""
+    options = {}
+    words = arg.split()
+    i = 0
+    while i < len(words):
+        word = words[i].lower()
+        if word == "--local":
+            options["local"] = True
+        elif word in ("--last", "--since"):
+            if i + 1 == len(words):
+                raise ValueError(f"{word} needs a value")
+            i += 1
+            if word == "--since":
+                options["since"] = parse_since(words[i])
+            elif words[i].isdigit() and int(words[i]) > 0:
+                options["last"] = int(words[i])
+            else:
+                raise ValueError(f"--last needs a positive number, not '{words[i]}'")
+        elif word.isdigit() and int(word) > 0:
+            options["page"] = int(word)
+        else:
+            raise ValueError(f"Unexpected argument '{words[i]}'")
+        i += 1
+    return options
+
+
+def _created(raw):
+    """Creation time (epoch ms) of a raw message."""
+    return ((raw.get("info") or {}).get("time") or {}).get("created") or 0
+
+
+def fetch_history(sid, newest, since=None):
+    """The newest `newest` raw messages of a session, oldest first, optionally only
+    those created after `since` (epoch ms), without fetching the whole session."""
+    raw_items = _fetch_raw_messages(sid, limit=newest)
+    if since is not None:
+        raw_items = [raw for raw in raw_items if _created(raw) >= since]
+    return raw_items
+
+
+def _materialize(sid, raw_items):
+    """Message objects for a window of raw messages, reusing settled ones already parsed."""
+    with message_lock:
+        cache = message_cache.get(sid) or {"items": {}, "settled": set()}
+        items, settled = cache["items"], cache["settled"]
+        return [
+            items[raw["info"]["id"]] if raw["info"]["id"] in settled
+            else Message(raw)
+            for raw in raw_items
+        ]
+
+
+def show_history(page=1, last=None, since=None, local=False):
+    """Display one page of the current session's messages (newest page is 1).
+
+    Only the requested window is fetched and parsed; `last` shows the newest
+    N messages instead, `since` pages through those after a time; `local`
+    reads the store.
+    """
+    newest = (last or page * HISTORY_PAGE) + 1
+    raw_items = None
+    if not local:
+        try:
+            raw_items = fetch_history(session_id, newest=newest, since=since)
+        except Exception as e:
+            console.print(f"[bold red]Error:[/] {e}")
+            if get_store() is None:
+                return
+    fetched = raw_items is not None
+    if not fetched:
+        raw_items = load_raw_messages(session_id, newest=newest, since=since)
+        console.print("[dim](from local transcript store)[/dim]")
+
+    # The extra message requested past the window only tells whether older ones exist
+    if last:
+        end = len(raw_items)
+        start = max(0, end - last)
+    else:
+        end = max(0, len(raw_items) - (page - 1) * HISTORY_PAGE)
+        start = max(0, end - HISTORY_PAGE)
+    window = raw_items[start:end]
+    if fetched:
+        store_messages(session_id, window)
+
+    if not window:
+        if page == 1:
+            console.print("[dim]No messages yet.[/dim]")
+        else:
+            console.print(f"[dim]No messages on page {page}.[/dim]")
         return
 
-    for msg in messages:
-        role = msg.info.role
+    for msg in _materialize(session_id, window):
+        role = msg.role
         if role == "user":
             # Show user message text parts
             for part in msg.parts:
@@ -412,37 +2291,163 @@ def show_history():
                     console.print(f"  [cyan]Tool: {part.tool} ({status})[/cyan]")
         console.print()
 
-
-def list_sessions():
-    """List all available sessions."""
-    try:
-        sessions = client.session.list()
-    except Exception as e:
-        console.print(f"[bold red]Error:[/] {e}")
+    if last:
+        older = f" · older: /history --last {last * 2}" if start > 0 else ""
+        console.print(f"[dim]Last {len(window)} messages{older}[/dim]")
         return
+    label = f"Page {page} · {len(window)} messages"
+    suffix = ""
+    if since is not None:
+        label += f" since {_format_time(since)}"
+        moment = datetime.datetime.fromtimestamp(since / 1000)
+        suffix = " --since " + moment.strftime("%Y-%m-%dT%H:%M")
+    if start > 0:
+        label += f" · older: /history {page + 1}{suffix}"
+    if page > 1:
+        label += f" · newer: /history {page - 1}{suffix}"
+    console.print(f"[dim]{label}[/dim]")
+
+
+def _format_time(ms):
+    """Local 'YYYY-MM-DD HH:MM' for an epoch-ms timestamp."""
+    return datetime.datetime.fromtimestamp(ms / 1000).strftime("%Y-%m-%d %H:%M")
+
+
+def parse_sessions_args(arg):
+    """Parse `/sessions` arguments into list_sessions() keyword arguments."""
+    options = {}
+    words = arg.split()
+    query = []
+    i = 0
+    while i < len(words):
+        word = words[i].lower()
+        if word == "--local":
+            options["local"] = True
+        elif word in ("--limit", "--offset"):
+            if i + 1 == len(words):
+                raise ValueError(f"{word} needs a value")
+            i += 1
+            if not words[i].isdigit() or (word == "--limit" and int(words[i]) == 0):
+                kind = "positive" if word == "--limit" else "non-negative"
+                raise ValueError(f"{word} needs a {kind} number, not '{words[i]}'")
+            options[word[2:]] = int(words[i])
+        elif word.startswith("--"):
+            raise ValueError(f"Unexpected argument '{words[i]}'")
+        else:
+            query.append(words[i])
+        i += 1
+    if query:
+        options["query"] = " ".join(query)
+    return options
+
+
+def _session_row(raw):
+    """A session from GET /session JSON, shaped like the store's (id, title, time)."""
+    t = raw.get("time") or {}
+    return types.SimpleNamespace(
+        id=raw["id"],
+        title=raw.get("title"),
+        time=types.SimpleNamespace(created=t.get("created"), updated=t.get("updated")),
+    )
+
+
+def fetch_sessions(limit, offset=0, query=""):
+    """Sessions `offset`..`offset + limit` of the server's list, most recently updated
+    first, optionally only those whose title contains `query`; returns (sessions, more).
+
+    The server is asked for just the rows up to the end of the page
+    (`?limit=`, plus `?search=`) and the page is cut out here, so a server
+    that ignores the parameters and sends its whole list gives the same page.
+    A server that cut its list but did not filter it by title, or not in
+    last-updated order, is asked again for the whole list. Only the returned
+    page is parsed and stored. Warm-pool sessions are hidden, so they are
+    added to the limit.
+    """
+    hidden = pooled_ids()
+    params = {"limit": offset + limit + len(hidden) + 1}
+    if query:
+        params["search"] = query
+    raws = client.session.with_raw_response.list(extra_query=params).json()
+    folded = query.casefold()
+
+    def matches(raw):
+        return folded in (raw.get("title") or "").casefold()
+
+    def updated(raw):
+        return (raw.get("time") or {}).get("updated") or 0
+
+    order = [updated(raw) for raw in raws]
+    if len(raws) >= params["limit"] and (
+        not all(map(matches, raws)) or order != sorted(order, reverse=True)
+    ):
+        raws = client.session.with_raw_response.list().json()
+    rows = [raw for raw in raws if raw["id"] not in hidden and matches(raw)]
+    rows.sort(key=updated, reverse=True)
+    sessions = [_session_row(raw) for raw in rows[offset:offset + limit]]
+    store_sessions(sessions)
+    return sessions, len(rows) > offset + limit
+
+
+def list_sessions(limit=SESSIONS_PAGE, offset=0, query="", local=False):
+    """List one page of sessions, most recently updated first (`local` reads the
+    transcript store). `query` keeps titles containing it (case-insensitive)."""
+    from rich.table import Table
+    global prefetched_sessions
+    page = None
+    if not local:
+        try:
+            warmed, prefetched_sessions = prefetched_sessions, None
+            if (
+                warmed is not None
+                and warmed[0] > sessions_changed
+                and time.monotonic() - warmed[0] < SESSIONS_PREFETCH_TTL
+                and (limit, offset, query) == (SESSIONS_PAGE, 0, "")
+            ):
+                # Pool sessions still being created when it was fetched weren't hidden
+                hidden = pooled_ids()
+                page = [s for s in warmed[1][0] if s.id not in hidden], warmed[1][1]
+            else:
+                page = fetch_sessions(limit, offset, query)
+        except Exception as e:
+            console.print(f"[bold red]Error:[/] {e}")
+            if get_store() is None:
+                return
+    if page is None:
+        rows = load_sessions(limit + 1, offset, query)
+        page = rows[:limit], len(rows) > limit
+        console.print("[dim](from local transcript store)[/dim]")
+    sessions, more = page
 
     if not sessions:
-        console.print("[dim]No sessions.[/dim]")
+        console.print("[dim]No sessions.[/dim]" if offset == 0 else "[dim]No more sessions.[/dim]")
         return
 
     table = Table(title="Sessions")
-    table.add_column("ID", style="cyan", max_width=12)
+    table.add_column("ID", style="cyan")
     table.add_column("Title", style="white")
     table.add_column("Active", style="green")
 
     for s in sessions:
-        sid = s.id[:8] + "..."
+        sid = short_id(s.id)
         title = s.title or "(untitled)"
         active = "→" if s.id == session_id else ""
         table.add_row(sid, title, active)
 
     console.print(table)
-
-
-def show_models():
-    """List all available providers and models."""
+    args = (f" {query}" if query else "") + (f" --limit {limit}" if limit != SESSIONS_PAGE else "")
+    args += " --local" if local else ""
+    label = f"Sessions {offset + 1}–{offset + len(sessions)}"
+    if more:
+        label += f" · more: /sessions{escape(args)} --offset {offset + limit}"
+    if offset > 0:
+        label += f" · previous: /sessions{escape(args)} --offset {max(0, offset - limit)}"
+    console.print(f"[dim]{label}[/dim]")
+
+
+def show_models(refresh=False):
+    """List all available providers and models (`refresh` bypasses the cache)."""
     try:
-        providers_resp = client.app.providers()
+        providers_resp = get_providers(refresh=refresh)
     except Exception as e:
         console.print(f"[bold red]Error:[/] {e}")
         return
@@ -477,7 +2482,7 @@ def switch_model(spec):
     global provider_id, model_id
 
     try:
-        providers_resp = client.app.providers()
+        providers_resp = get_providers()
     except Exception as e:
         console.print(f"[bold red]Error:[/] {e}")
         return
@@ -516,18 +2521,316 @@ def switch_model(spec):
     console.print(f"[green]Switched to {provider_id}/{model_id}[/green]")
 
 
+def show_output(prefix):
+    """Show the full output of a tool part (by ID or unique ID prefix) in a pager."""
+    if not prefix:
+        console.print("[dim]Usage: /output <part-id>[/dim]")
+        return
+
+    matches = {pid for pid in spilled if pid.startswith(prefix)}
+    outputs = {}
+    with message_lock:
+        cache = message_cache.get(session_id) or {"order": [], "items": {}}
+        for mid in cache["order"]:
+            for part in cache["items"][mid].parts:
+                if part.type == "tool" and part.id.startswith(prefix) and part.id not in spilled:
+                    outputs[part.id] = getattr(part.state, "output", None) or ""
+    matches.update(outputs)
+
+    if not matches:
+        console.print(f"[red]No tool output matching '{escape(prefix)}'.[/red]")
+        return
+    if len(matches) > 1:
+        console.print(f"[yellow]Ambiguous part ID; matches:[/] {', '.join(sorted(matches))}")
+        return
+    pid = matches.pop()
+    path = spilled[pid][0] if pid in spilled else spill_output(pid, outputs[pid])
+    page_file(path)
+
+
+def page_file(path):
+    """Show a file in $PAGER (default `less -R`), or copy it to the console in chunks.
+
+    The pager reads the file itself; otherwise it is memory-mapped and
+    decoded PAGE_CHUNK bytes at a time, so it is never loaded whole.
+    """
+    import mmap
+    import shlex
+    import codecs
+
+    # The async REPL's input thread owns stdin, so it gets the plain copy
+    if async_client is None and console.is_terminal and sys.stdin.isatty():
+        try:
+            subprocess.run(shlex.split(os.environ.get("PAGER") or "less -R") + [path])
+            return
+        except OSError:
+            pass  # no such pager
+
+    if os.path.getsize(path) == 0:
+        return
+    decoder = codecs.getincrementaldecoder("utf-8")("replace")
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        for start in range(0, len(data), PAGE_CHUNK):
+            console.out(decoder.decode(data[start:start + PAGE_CHUNK]), end="", highlight=False)
+    console.out(decoder.decode(b"", final=True), highlight=False)
+
+
+def search_sessions(query):
+    """Full-text search over every stored session and show ranked hits."""
+    from rich.table import Table
+    if not query:
+        console.print("[dim]Usage: /search <query>[/dim]")
+        return
+    if get_store() is None:
+        console.print("[red]Search needs the local transcript store (OPENCODE_CHAT_STORE=1).[/red]")
+        return
+
+    started = time.perf_counter()
+    try:
+        hits = search_transcripts(query)
+    except sqlite3.Error as e:
+        console.print(f"[bold red]Search error:[/] {e}")
+        return
+    elapsed = (time.perf_counter() - started) * 1000
+
+    if not hits:
+        console.print(f"[dim]No matches for '{escape(query)}'.[/dim]")
+        return
+
+    table = Table(title=f"Search: {escape(query)}", caption=f"{len(hits)} hits in {elapsed:.0f} ms")
+    table.add_column("Session", style="cyan", no_wrap=True)
+    table.add_column("Title", max_width=20)
+    table.add_column("When", style="dim")
+    table.add_column("Where")
+    table.add_column("Match")
+    for sid, title, _, _, role, kind, created, snippet in hits:
+        when = _format_time(created) if created else ""
+        match = escape((snippet or "").replace("\n", " "))
+        match = match.replace("\x01", "[bold yellow]").replace("\x02", "[/bold yellow]")
+        table.add_row(short_id(sid), escape(title or ""), when, f"{role} {kind}", match)
+    console.print(table)
+    console.print("[dim]/resume <id> opens a session and shows its last response.[/dim]")
+
+
+def write_stats(path):
+    """Dump latency summaries of every session to a JSON file."""
+    payload = {sid: stats_summary(sid) for sid in list(turn_stats)}
+    with open(path, "w") as f:
+        json.dump({"window": STATS_WINDOW, "sessions": payload}, f, indent=2)
+
+
+def show_stats(arg=""):
+    """Show per-phase latency percentiles, or dump them with '--json [FILE]'."""
+    from rich.table import Table
+    args = arg.split()
+    if args and args[0] == "--json":
+        if len(args) > 1:
+            try:
+                write_stats(args[1])
+            except OSError as e:
+                console.print(f"[bold red]Error:[/] {e}")
+                return
+            console.print(f"[green]Wrote {args[1]}[/green]")
+        else:
+            payload = {sid: stats_summary(sid) for sid in list(turn_stats)}
+            console.print_json(json.dumps(payload))
+        return
+
+    summary = stats_summary(session_id)
+    if not summary:
+        console.print("[dim]No timings recorded yet.[/dim]")
+        return
+
+    table = Table(title=f"Latency (ms), session {session_id[:8]}..., last {STATS_WINDOW} samples")
+    table.add_column("Phase", style="cyan")
+    for column in ("Count", "Mean", "p50", "p95", "p99", "Max"):
+        table.add_column(column, justify="right")
+    phases = [p for p in STATS_PHASES if p in summary]
+    phases += [p for p in summary if p not in STATS_PHASES]
+    for phase in phases:
+        row = summary[phase]
+        table.add_row(
+            phase,
+            str(row["count"]),
+            f"{row['mean_ms']:.1f}",
+            f"{row['p50_ms']:.1f}",
+            f"{row['p95_ms']:.1f}",
+            f"{row['p99_ms']:.1f}",
+            f"{row['max_ms']:.1f}",
+        )
+    console.print(table)
+
+
+def _spend_row(label, totals):
+    """Table cells for a ledger_totals() result."""
+    turns, tokens_in, tokens_out, reasoning, cache_read, cache_write, cost = totals
+    return [label, f"{turns:,}", f"{tokens_in:,}", f"{tokens_out:,}", f"{reasoning:,}",
+            f"{cache_read:,}/{cache_write:,}", f"${cost:.4f}"]
+
+
+def show_cost(arg=""):
+    """Show spend from the ledger: last turn, this session, today and all time, or
+    grouped with '--by model|day|session'; then the budgets."""
+    from rich.table import Table
+    if get_store() is None:
+        console.print(
+            "[dim]The cost ledger lives in the transcript store, which is disabled.[/dim]"
+        )
+        return
+    args = arg.split()
+    if args and (args[0] != "--by" or len(args) != 2 or args[1] not in LEDGER_GROUPS):
+        console.print("[dim]Usage: /cost \\[--by model|day|session][/dim]")
+        return
+
+    flush_pending_writes()  # a turn that just ended may still be on its way to the ledger
+    columns = ("Turns", "Input", "Output", "Reasoning", "Cache r/w", "Cost")
+    if args:
+        table = Table(title=f"Spend by {args[1]}")
+        table.add_column(args[1].capitalize(), style="cyan", no_wrap=True, max_width=24)
+        rows = [_spend_row(escape(str(key)), totals) for key, totals in ledger_by(args[1])]
+    else:
+        table = Table(title=f"Spend, session {session_id[:8]}...")
+        table.add_column("Scope", style="cyan", no_wrap=True)
+        rows = [
+            _spend_row(label, ledger_totals(**where))
+            for label, where in (
+                ("Last turn", {"session": session_id, "turn": last_turn_id(session_id)}),
+                ("This session", {"session": session_id}),
+                ("Today", {"day": _today()}),
+                ("All time", {}),
+            )
+        ]
+    for column in columns:
+        table.add_column(column, justify="right")
+    for row in rows:
+        table.add_row(*row)
+    console.print(table)
+
+    for label, budget, where in (
+        ("Session", BUDGET_SESSION, {"session": session_id}),
+        ("Daily", BUDGET_DAY, {"day": _today()}),
+    ):
+        if budget > 0:
+            spent = ledger_totals(**where)[-1]
+            share = spent / budget
+            console.print(f"[dim]{label} budget: ${spent:.4f} of ${budget:g} ({share:.0%})[/dim]")
+
+
+def set_caps(arg=""):
+    """Show the hard caps and this session's usage, or set one: '<turn|session> <kind> <limit>'."""
+    from rich.table import Table
+    words = arg.split()
+    if words:
+        try:
+            scope, kind, limit = words
+            limit = float(limit.lstrip("$").rstrip("s"))
+            if scope not in ("turn", "session") or kind not in CAP_KINDS or limit < 0:
+                raise ValueError
+        except ValueError:
+            kinds = "|".join(CAP_KINDS)
+            console.print(f"[dim]Usage: /caps \\[turn|session <{kinds}> <limit>] (0 = none)[/dim]")
+            return
+        (turn_caps if scope == "turn" else session_caps)[kind] = limit
+        shown = _cap_text(kind, limit) if limit else "off"
+        console.print(f"[green]{scope.capitalize()} {kind} cap: {shown}.[/green]")
+        return
+
+    usage = load_session_usage(session_id)
+    table = Table(title=f"Hard caps, session {session_id[:8]}...")
+    table.add_column("Kind", style="cyan")
+    table.add_column("Per turn", justify="right")
+    table.add_column("Per session", justify="right")
+    table.add_column("Session so far", justify="right")
+    for kind in CAP_KINDS:
+        table.add_row(
+            kind,
+            _cap_text(kind, turn_caps[kind]) if turn_caps[kind] else "[dim]—[/dim]",
+            _cap_text(kind, session_caps[kind]) if session_caps[kind] else "[dim]—[/dim]",
+            _cap_text(kind, usage[kind]),
+        )
+    console.print(table)
+
+
+def check_budgets(sid):
+    """Alert (once per level) when the session's or today's spend passes BUDGET_WARN
+    of its budget, and again when it passes the budget."""
+    for scope, budget, where in (
+        ("session", BUDGET_SESSION, {"session": sid}),
+        ("day", BUDGET_DAY, {"day": _today()}),
+    ):
+        if budget <= 0:
+            continue
+        spent = ledger_totals(**where)[-1]
+        level = 1.0 if spent >= budget else BUDGET_WARN if spent >= budget * BUDGET_WARN else None
+        key = (scope, where[scope], level)
+        if level is None or key in budget_alerts:
+            continue
+        budget_alerts.add(key)
+        subject = f"Session {sid[:8]}..." if scope == "session" else "Today's spend"
+        verb = "is over" if level == 1.0 else f"has reached {level:.0%} of"
+        color = "bold red" if level == 1.0 else "yellow"
+        notify(f"[{color}]{subject} {verb} its ${budget:g} budget (${spent:.4f} spent).[/{color}]")
+
+
+def set_streaming(arg):
+    """Toggle live event streaming ('on', 'off', or no argument to flip)."""
+    global stream_enabled
+    if arg in ("on", "off"):
+        stream_enabled = arg == "on"
+    elif arg:
+        console.print("[dim]Usage: /stream \\[on|off][/dim]")
+        return
+    else:
+        stream_enabled = not stream_enabled
+    state = "on" if stream_enabled else "off"
+    console.print(f"[green]Streaming {state}.[/green]")
+
+
 def show_help():
     """Display available commands."""
+    from rich.table import Table
     table = Table(title="Commands")
     table.add_column("Command", style="cyan")
     table.add_column("Description")
     table.add_row("/help", "Show this help message")
     table.add_row("/new", "Start a new chat session")
-    table.add_row("/history", "Show messages in the current session")
-    table.add_row("/sessions", "List all sessions")
-    table.add_row("/models", "List all available providers and models")
+    table.add_row(
+        "/history \\[page] \\[--local]",
+        f"Show messages in the current session, {HISTORY_PAGE} per page (1 = newest)",
+    )
+    table.add_row(
+        "/history --last N | --since T",
+        "Show the newest N messages, or those since T (30m, 2h, 14:30, 2024-05-01)",
+    )
+    table.add_row(
+        "/sessions \\[filter] \\[--local]",
+        f"List sessions, newest first, {SESSIONS_PAGE} per page; filter matches titles",
+    )
+    table.add_row("/sessions --limit N --offset M", "Show N sessions starting after the first M")
+    table.add_row(
+        "/switch \\[id]",
+        "Switch to (and attach) a session by ID prefix; no ID lists attached sessions",
+    )
+    table.add_row(
+        "/resume <prefix>",
+        "Reattach to a session by ID or title prefix and show its last response",
+    )
+    table.add_row("/bg <message>", "Send a message and let the turn run in the background")
+    table.add_row("/models [--refresh]", "List all available providers and models")
     table.add_row("/model", "Show current model")
     table.add_row("/model <provider>/<id>", "Switch model (e.g. /model anthropic/claude-3-5-haiku-latest)")
+    table.add_row("/stream \\[on|off]", "Toggle live streaming of responses")
+    table.add_row("/output <part-id>", "Show a tool's full output in a pager")
+    table.add_row("/search <query>", "Full-text search across all stored sessions")
+    table.add_row(
+        "/cost \\[--by model|day|session]",
+        "Show tokens and cost from the local ledger (turn, session, today, all time)",
+    )
+    table.add_row(
+        "/caps \\[turn|session <kind> <limit>]",
+        "Show or set hard caps (tokens, cost, seconds, tools; 0 = none) that abort a turn",
+    )
+    table.add_row("/stats [--json \\[file]]", "Show per-phase latency percentiles for this session")
     table.add_row("/abort", "Abort the current request")
     table.add_row("/quit", "Clean up and exit (also /exit)")
     console.print(table)
@@ -536,15 +2839,20 @@ def show_help():
 def repl():
     """Main input loop."""
     while True:
+        flush_notifications()
+        prompt_waiting.set()
         try:
             text = console.input("[bold green]You>[/] ").strip()
         except (EOFError, KeyboardInterrupt):
             console.print("\nGoodbye!")
             break
+        finally:
+            prompt_waiting.clear()
 
         if not text:
             continue
 
+        finish_startup()
         if text.startswith("/"):
             handle_command(text)
         else:
@@ -553,6 +2861,52 @@ def repl():
 
 def main():
     """Entry point."""
+    parser = argparse.ArgumentParser(description="Terminal chat client for OpenCode")
+    parser.add_argument("--version", action="version", version=f"opencode-chat {__version__}")
+    parser.add_argument(
+        "--async",
+        dest="use_async",
+        action="store_true",
+        help="run on the asyncio runtime (input, rendering and /abort stay live during a turn)",
+    )
+    parser.add_argument(
+        "--session",
+        metavar="PREFIX",
+        help="resume the session with this ID (or title) prefix instead of starting a new one",
+    )
+    parser.add_argument(
+        "--batch",
+        metavar="FILE",
+        help="run prompts from a JSONL file ('-' for stdin) non-interactively",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=4,
+        help="batch mode: number of prompts in flight at once (default: 4)",
+    )
+    parser.add_argument(
+        "--output",
+        metavar="FILE",
+        default="-",
+        help="batch mode: where to write JSONL results (default: stdout)",
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=300,
+        help="batch mode: seconds allowed per prompt (default: 300)",
+    )
+    args = parser.parse_args()
+
+    stats_file = os.environ.get("OPENCODE_CHAT_STATS_FILE")
+    if stats_file:
+        atexit.register(write_stats, stats_file)
+
+    if args.batch:
+        sys.exit(batch_main(args))
+
+    from rich.panel import Panel
     console.print(
         Panel(
             "[bold]opencode-chat[/bold]\n"
@@ -562,11 +2916,1004 @@ def main():
         )
     )
 
-    ensure_opencode()
-    create_session()
-    repl()
+    url = ensure_opencode(connect=False)
+    start_startup_tasks(url, resume=args.session)
+    if args.use_async:
+        import asyncio
+        asyncio.run(async_repl(url))
+    else:
+        repl()
+    report_background_turns()
+    drain_session_pool()
     cleanup_opencode()
 
 
+# ---------------------------------------------------------------------------
+# Section E: Async runtime
+# ---------------------------------------------------------------------------
+
+
+async def async_stream_response(sid, text, guard=None):
+    """Async counterpart of stream_response() over the AsyncOpencode client."""
+    import asyncio
+    try:
+        stream = await async_client.event.list(timeout=httpx.Timeout(None, connect=5.0))
+    except Exception:
+        stream = None
+
+    if stream is None:
+        if guard is not None:
+            guard.watch()
+        with phase_timer("chat", sid):
+            await async_client.session.chat(
+                sid,
+                model_id=model_id,
+                provider_id=provider_id,
+                parts=[{"type": "text", "text": text}],
+                timeout=300,
+            )
+        await asyncio.get_running_loop().run_in_executor(None, display_response, sid)
+        return
+
+    renderer = StreamRenderer(sid)
+    started = time.perf_counter()
+    render_time = [0.0]
+    caught_up = False
+
+    async def consume():
+        async for event in stream:
+            if guard is not None:
+                guard.handle(event)
+            seen_output = renderer.rendered
+            handle_started = time.perf_counter()
+            renderer.handle(event)
+            render_time[0] += time.perf_counter() - handle_started
+            if renderer.rendered and not seen_output:
+                record_timing("first_output", time.perf_counter() - started, sid)
+            if renderer.idle:
+                return
+
+    consumer = asyncio.ensure_future(consume())
+    try:
+        with phase_timer("chat", sid):
+            await async_client.session.chat(
+                sid,
+                model_id=model_id,
+                provider_id=provider_id,
+                parts=[{"type": "text", "text": text}],
+                timeout=300,
+            )
+        # Give trailing events a moment to arrive
+        try:
+            await asyncio.wait_for(consumer, STREAM_GRACE)
+        except (asyncio.TimeoutError, Exception):
+            pass
+        if renderer.rendered and not renderer.idle:
+            # Stream ended or went quiet before idle: show the rest from the server
+            try:
+                loop = asyncio.get_running_loop()
+                renderer.catch_up(await loop.run_in_executor(None, fetch_messages, sid))
+                caught_up = True
+            except Exception as e:
+                console.print(f"[bold red]Error fetching messages:[/] {e}")
+    finally:
+        consumer.cancel()
+        renderer.finish()
+        await stream.close()
+        if renderer.rendered:
+            record_timing("render", render_time[0], sid)
+
+    if not renderer.rendered:
+        await asyncio.get_running_loop().run_in_executor(None, display_response, sid)
+    elif not caught_up:
+        persist_turn(sid)
+
+
+async def async_send_message(sid, text):
+    """Run one chat turn as a task; cancellation is how /abort and Ctrl-C stop it."""
+    import asyncio
+    from opencode_ai import APIConnectionError, APIStatusError
+    guard = turn_guard(sid)
+    if guard is not None and guard.reason:
+        console.print(
+            f"[bold red]Not sent: {guard.reason}.[/bold red] [dim]/caps changes the caps.[/dim]"
+        )
+        return
+    drop_prefetched_sessions()
+    console.print("[dim]Thinking...[/dim]")
+    try:
+        with phase_timer("turn", sid):
+            if stream_enabled:
+                await async_stream_response(sid, text, guard)
+            else:
+                if guard is not None:
+                    guard.watch()
+                with phase_timer("chat", sid):
+                    await async_client.session.chat(
+                        sid,
+                        model_id=model_id,
+                        provider_id=provider_id,
+                        parts=[{"type": "text", "text": text}],
+                        timeout=300,
+                    )
+                await asyncio.get_running_loop().run_in_executor(None, display_response, sid)
+
+    except asyncio.CancelledError:
+        raise
+
+    except APIConnectionError:
+        console.print("[bold red]Lost connection to OpenCode server.[/bold red]")
+
+    except APIStatusError as e:
+        console.print(f"[bold red]API error ({e.status_code}):[/] {e.message}")
+
+    except Exception as e:
+        console.print(f"[bold red]Error:[/] {e}")
+
+    finally:
+        if guard is not None:
+            guard.close()
+
+
+async def async_abort(turn, sid, reprompt=False):
+    """Cancel the running turn locally and tell the server to stop it.
+
+    `reprompt` redraws the prompt afterwards, for aborts not typed at it (Ctrl-C).
+    """
+    cancelled = turn is not None and not turn.done()
+    if cancelled:
+        turn.cancel()
+        console.print("\n[yellow]Aborting...[/yellow]")
+    try:
+        await async_client.session.abort(sid)
+        console.print("[yellow]Aborted.[/yellow]")
+    except Exception as e:
+        console.print(f"[red]Abort failed:[/] {e}")
+    if cancelled and reprompt:
+        # The input thread is already waiting without a prompt; show one
+        console.print("[bold green]You>[/] ", end="")
+
+
+async def health_check():
+    """Background task: report when the server becomes unreachable or comes back."""
+    import asyncio
+    healthy = True
+    while True:
+        await asyncio.sleep(HEALTH_INTERVAL)
+        try:
+            # Raw and limited: a parsed full session list would block the loop
+            await async_client.with_options(max_retries=0).session.with_raw_response.list(
+                extra_query={"limit": 1}, timeout=PROBE_TIMEOUT
+            )
+            ok = True
+        except Exception:
+            ok = False
+        if ok != healthy:
+            healthy = ok
+            if ok:
+                console.print("[dim]OpenCode server is reachable again.[/dim]")
+            else:
+                console.print("[bold red]OpenCode server is not responding.[/bold red]")
+
+
+def _read_input(loop, inbox, busy, handled):
+    """Input thread: feed lines into the event loop (None on EOF/Ctrl-D).
+
+    The prompt is only printed while no turn is running; during a turn input
+    is still read so /abort can be typed. Each line waits for the loop to
+    dispatch it before the next prompt, so the busy flag is up to date.
+    """
+    while True:
+        idle = not busy.is_set()
+        if idle:
+            flush_notifications()
+            prompt_waiting.set()
+        try:
+            line = console.input("[bold green]You>[/] " if idle else "")
+        except (EOFError, KeyboardInterrupt):
+            loop.call_soon_threadsafe(inbox.put_nowait, None)
+            return
+        finally:
+            prompt_waiting.clear()
+        handled.clear()
+        loop.call_soon_threadsafe(inbox.put_nowait, line)
+        handled.wait()
+
+
+async def async_repl(url):
+    """Main input loop on asyncio: turns, rendering and health checks run as tasks."""
+    import asyncio
+    global async_client
+    async_client = make_async_client(url)
+    loop = asyncio.get_running_loop()
+    inbox = asyncio.Queue()
+    busy = threading.Event()
+    handled = threading.Event()
+    turn = None
+
+    def on_sigint():
+        # Ctrl-C aborts a running turn immediately, otherwise exits
+        if turn is not None and not turn.done():
+            asyncio.ensure_future(async_abort(turn, session_id, reprompt=True))
+        else:
+            inbox.put_nowait(None)
+
+    try:
+        loop.add_signal_handler(signal.SIGINT, on_sigint)
+    except (NotImplementedError, RuntimeError):
+        pass  # e.g. Windows: Ctrl-C falls back to KeyboardInterrupt
+
+    async def run_turn(sid, text):
+        try:
+            await async_send_message(sid, text)
+        finally:
+            busy.clear()
+        # Not reached when cancelled (/abort or Ctrl-C)
+        flush_notifications()
+        with notify_lock:
+            prompt_waiting.set()
+            console.print("[bold green]You>[/] ", end="")
+
+    threading.Thread(
+        target=_read_input, args=(loop, inbox, busy, handled), daemon=True
+    ).start()
+    health = asyncio.ensure_future(health_check())
+
+    try:
+        while True:
+            line = await inbox.get()
+            if line is None:
+                console.print("\nGoodbye!")
+                break
+
+            text = line.strip()
+            if text:
+                await loop.run_in_executor(None, finish_startup)
+            if not text:
+                pass
+            elif text.lower() == "/abort":
+                await async_abort(turn, session_id)
+            elif text.startswith("/"):
+                await loop.run_in_executor(None, handle_command, text)
+            elif turn is not None and not turn.done():
+                console.print(
+                    "[yellow]A turn is still running; /abort it first, or use /bg.[/yellow]"
+                )
+            elif session_busy(session_id):
+                console.print(
+                    "[yellow]A background turn is running in this session; "
+                    "/switch to another or /abort it.[/yellow]"
+                )
+            else:
+                busy.set()
+                turn = asyncio.ensure_future(run_turn(session_id, text))
+            handled.set()
+    finally:
+        health.cancel()
+        if turn is not None and not turn.done():
+            turn.cancel()
+        try:
+            loop.remove_signal_handler(signal.SIGINT)
+        except (NotImplementedError, RuntimeError):
+            pass
+        await async_client.close()
+
+
+# ---------------------------------------------------------------------------
+# Section F: Batch mode
+# ---------------------------------------------------------------------------
+
+
+def read_prompts(path):
+    """Read batch input: one JSON object with a "prompt" (or a JSON string) per line.
+
+    Objects may also carry an "id", echoed into the result, and a "model"
+    as "provider/model" to override the default for that prompt.
+    """
+    f = sys.stdin if path == "-" else open(path)
+    try:
+        items = []
+        for lineno, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            item = json.loads(line)
+            if isinstance(item, str):
+                item = {"prompt": item}
+            if not isinstance(item, dict) or not item.get("prompt"):
+                raise ValueError(f"line {lineno}: expected a \"prompt\"")
+            items.append(item)
+        return items
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+
+def summarize_turn(messages):
+    """Collect final text, tool calls, tokens, cost and error from a turn's messages."""
+    summary = {
+        "text": "",
+        "tool_calls": [],
+        "tokens": {"input": 0, "output": 0, "reasoning": 0, "cache_read": 0, "cache_write": 0},
+        "cost": 0.0,
+        "error": None,
+    }
+    for msg in messages:
+        if msg.role != "assistant":
+            continue
+        summary["cost"] += msg.cost
+        if msg.tokens is not None:
+            for key in summary["tokens"]:
+                summary["tokens"][key] += int(getattr(msg.tokens, key))
+        if msg.error is not None:
+            summary["error"] = f"{msg.error.name}: {msg.error.data.message}".rstrip(": ")
+
+        texts = []
+        for part in msg.parts:
+            if part.type == "text" and part.text:
+                texts.append(part.text)
+            elif part.type == "tool":
+                summary["tool_calls"].append({
+                    "tool": part.tool,
+                    "status": part.state.status,
+                    "title": getattr(part.state, "title", None),
+                })
+        if texts:
+            # The final answer is the text of the last assistant message
+            summary["text"] = "\n\n".join(texts)
+    return summary
+
+
+async def run_batch_item(index, item, limit, out, timeout, progress):
+    """Run one prompt in a fresh session and write its result line.
+
+    The session comes from the warm pool when one is ready; the pool is kept
+    topped up for the prompts still waiting for a slot (`progress["waiting"]`).
+    """
+    from opencode_ai import APIStatusError
+    async with limit:
+        started = time.monotonic()
+        record = {"index": index, "id": item.get("id"), "prompt": item["prompt"]}
+        guard = None
+        pid, mid = provider_id, model_id
+        if item.get("model"):
+            if "/" in item["model"]:
+                pid, mid = item["model"].split("/", 1)
+            else:
+                mid = item["model"]
+        record["model"] = f"{pid}/{mid}"
+        try:
+            progress["waiting"] -= 1
+            session = pop_pooled_session()
+            fill_session_pool(min(progress["concurrency"], progress["waiting"]))
+            if session is None:
+                session = await async_client.session.create(extra_body={})
+            record["session_id"] = session.id
+            guard = turn_guard(session.id, report=lambda text: None)
+            if guard is not None:
+                guard.watch()
+            await async_client.session.chat(
+                session.id,
+                model_id=mid,
+                provider_id=pid,
+                parts=[{"type": "text", "text": item["prompt"]}],
+                timeout=timeout,
+            )
+            # chat() returns a misparsed message; read the turn back instead
+            resp = await async_client.session.with_raw_response.messages(session.id)
+            raw_items = await resp.json()
+            messages = [Message(raw) for raw in raw_items]
+            record.update(summarize_turn(messages))
+            store_sessions([session])
+            store_messages(session.id, raw_items)
+        except APIStatusError as e:
+            record["error"] = f"API error ({e.status_code}): {e.message}"
+        except Exception as e:
+            record["error"] = f"{type(e).__name__}: {e}"
+        if guard is not None:
+            guard.close()
+            if guard.reason:
+                record["aborted"] = guard.reason
+        record["latency"] = round(time.monotonic() - started, 3)
+        out.write(json.dumps(record) + "\n")
+        out.flush()
+        return record
+
+
+async def run_batch(items, concurrency, out, timeout):
+    """Fan prompts out across sessions with at most `concurrency` in flight."""
+    import asyncio
+    global async_client
+    # Room for one chat plus one follow-up request per prompt in flight
+    async_client = make_async_client(
+        client.base_url,
+        limits=httpx.Limits(
+            max_connections=concurrency * 2,
+            max_keepalive_connections=concurrency * 2,
+            keepalive_expiry=HTTP_LIMITS.keepalive_expiry,
+        ),
+    )
+    limit = asyncio.Semaphore(concurrency)
+    progress = {"waiting": len(items), "concurrency": concurrency}
+    # The first wave creates its own sessions; the pool serves the ones after it
+    fill_session_pool(min(concurrency, max(0, len(items) - concurrency)))
+    try:
+        return await asyncio.gather(*(
+            run_batch_item(i, item, limit, out, timeout, progress)
+            for i, item in enumerate(items)
+        ))
+    finally:
+        await async_client.close()
+
+
+def batch_main(args):
+    """Run --batch mode; returns the process exit code (1 if any prompt failed)."""
+    global console
+    import asyncio
+    # stdout may carry the results; keep status output off it
+    console = Console(stderr=True)
+
+    try:
+        items = read_prompts(args.batch)
+    except (OSError, ValueError) as e:
+        console.print(f"[bold red]Error reading prompts:[/] {e}")
+        return 2
+    if not items:
+        console.print("[dim]No prompts.[/dim]")
+        return 0
+
+    ensure_opencode()
+    out = sys.stdout if args.output == "-" else open(args.output, "w")
+    started = time.monotonic()
+    try:
+        results = asyncio.run(
+            run_batch(items, max(1, args.concurrency), out, args.timeout)
+        )
+    finally:
+        if out is not sys.stdout:
+            out.close()
+        drain_session_pool()
+        cleanup_opencode()
+
+    failed = sum(1 for r in results if r.get("error"))
+    cost = sum(r.get("cost") or 0 for r in results)
+    console.print(
+        f"[dim]{len(results)} prompts, {failed} failed, ${cost:.4f}, "
+        f"{time.monotonic() - started:.1f}s[/dim]"
+    )
+    return 1 if failed else 0
+
+
+# ---------------------------------------------------------------------------
+# Section G: Local transcript store
+# ---------------------------------------------------------------------------
+
+STORE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id      TEXT PRIMARY KEY,
+    title   TEXT,
+    created REAL,
+    updated REAL
+);
+CREATE TABLE IF NOT EXISTS messages (
+    id               TEXT PRIMARY KEY,
+    session_id       TEXT NOT NULL,
+    role             TEXT NOT NULL,
+    created          REAL,
+    completed        REAL,
+    provider_id      TEXT,
+    model_id         TEXT,
+    cost             REAL,
+    tokens_input     INTEGER,
+    tokens_output    INTEGER,
+    tokens_reasoning INTEGER,
+    cache_read       INTEGER,
+    cache_write      INTEGER,
+    error            TEXT,
+    info             TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS parts (
+    id         TEXT PRIMARY KEY,
+    message_id TEXT NOT NULL,
+    session_id TEXT NOT NULL,
+    seq        INTEGER NOT NULL,
+    type       TEXT NOT NULL,
+    tool       TEXT,
+    status     TEXT,
+    text       TEXT,
+    data       TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS messages_session ON messages (session_id, created);
+CREATE INDEX IF NOT EXISTS messages_role ON messages (role, created);
+CREATE INDEX IF NOT EXISTS messages_created ON messages (created);
+CREATE INDEX IF NOT EXISTS parts_message ON parts (message_id, seq);
+CREATE INDEX IF NOT EXISTS parts_session ON parts (session_id);
+CREATE INDEX IF NOT EXISTS parts_tool ON parts (tool) WHERE tool IS NOT NULL;
+CREATE INDEX IF NOT EXISTS sessions_updated ON sessions (updated);
+CREATE TABLE IF NOT EXISTS ledger (
+    step_id          TEXT PRIMARY KEY,  -- step-finish part (message id if it had none)
+    session_id       TEXT NOT NULL,
+    message_id       TEXT NOT NULL,
+    turn_id          TEXT,              -- user message that started the turn
+    provider_id      TEXT,
+    model_id         TEXT,
+    day              TEXT NOT NULL,     -- local date, YYYY-MM-DD
+    created          REAL,
+    tokens_input     INTEGER,
+    tokens_output    INTEGER,
+    tokens_reasoning INTEGER,
+    cache_read       INTEGER,
+    cache_write      INTEGER,
+    cost             REAL
+);
+CREATE INDEX IF NOT EXISTS ledger_session ON ledger (session_id, turn_id);
+CREATE INDEX IF NOT EXISTS ledger_day ON ledger (day);
+"""
+
+# Full-text index over parts; rowids match parts.rowid
+SEARCH_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS parts_fts USING fts5(content, tokenize = 'unicode61');
+"""
+SEARCH_VERSION = 2  # PRAGMA user_version from which parts_fts is populated
+STORE_VERSION = 3  # PRAGMA user_version; 3 = ledger backfilled
+LEDGER_GROUPS = {
+    "model": "COALESCE(provider_id, '?') || '/' || COALESCE(model_id, '?')",
+    "day": "day",
+    "session": "session_id",
+}
+
+
+def get_store():
+    """Open (creating if needed) the transcript database; None if disabled or unusable."""
+    global store, store_enabled
+    if store is None and store_enabled:
+        with store_lock:
+            if store is not None:
+                return store
+            try:
+                os.makedirs(os.path.dirname(STORE_PATH), exist_ok=True)
+                db = sqlite3.connect(STORE_PATH, check_same_thread=False)
+                db.execute("PRAGMA journal_mode=WAL")
+                db.execute("PRAGMA synchronous=NORMAL")
+                db.executescript(STORE_SCHEMA)
+                _init_search(db)
+                _init_ledger(db)
+                store = db
+                atexit.register(db.close)
+                # Registered after close, so it runs first (atexit is LIFO)
+                atexit.register(flush_pending_writes)
+            except (sqlite3.Error, OSError) as e:
+                console.print(f"[yellow]Transcript store disabled:[/] {e}")
+                store_enabled = False
+    return store
+
+
+def _init_search(db):
+    """Create the full-text index and backfill it for stores created before it existed."""
+    global search_enabled
+    try:
+        db.executescript(SEARCH_SCHEMA)
+    except sqlite3.OperationalError:
+        return  # SQLite built without FTS5; /search falls back to LIKE
+    search_enabled = True
+    if db.execute("PRAGMA user_version").fetchone()[0] >= SEARCH_VERSION:
+        return
+    with db:
+        db.execute("DELETE FROM parts_fts")
+        for rowid, data in db.execute("SELECT rowid, data FROM parts").fetchall():
+            content = _search_text(json.loads(data))
+            if content:
+                db.execute(
+                    "INSERT INTO parts_fts (rowid, content) VALUES (?, ?)", (rowid, content)
+                )
+        db.execute(f"PRAGMA user_version = {SEARCH_VERSION}")
+
+
+def _init_ledger(db):
+    """Backfill the ledger from the stored messages of stores created before it existed."""
+    if db.execute("PRAGMA user_version").fetchone()[0] >= STORE_VERSION:
+        return
+    with db:
+        steps = collections.defaultdict(list)
+        parts = db.execute("SELECT message_id, data FROM parts WHERE type = 'step-finish'")
+        for mid, data in parts:
+            steps[mid].append(json.loads(data))
+        sessions = db.execute("SELECT DISTINCT session_id FROM messages WHERE role = 'assistant'")
+        for (sid,) in sessions.fetchall():
+            raw_items = [
+                {"info": json.loads(info), "parts": steps.get(mid, [])}
+                for mid, info in db.execute(
+                    "SELECT id, info FROM messages WHERE session_id = ? ORDER BY created", (sid,)
+                )
+            ]
+            _record_steps(db, sid, raw_items)
+        db.execute(f"PRAGMA user_version = {STORE_VERSION}")
+
+
+def _record_steps(db, sid, raw_items):
+    """Add the ledger rows of raw messages' finished steps (caller holds the transaction).
+
+    Returns how many rows are new; steps already recorded are left alone.
+    """
+    rows = []
+    turn_id = None
+    for raw in raw_items:
+        info = raw["info"]
+        if info.get("role") == "user":
+            turn_id = info["id"]
+            continue
+        t = info.get("time") or {}
+        created = t.get("created") or 0
+        if turn_id is None:
+            found = db.execute(
+                "SELECT id FROM messages WHERE session_id = ? AND role = 'user' AND created <= ? "
+                "ORDER BY created DESC LIMIT 1",
+                (sid, created),
+            ).fetchone()
+            turn_id = found[0] if found else None
+        steps = [p for p in raw.get("parts") or [] if p.get("type") == "step-finish"]
+        if not steps and t.get("completed") and info.get("cost"):
+            steps = [info]  # no step parts: the message's own totals
+        day = datetime.datetime.fromtimestamp(created / 1000).strftime("%Y-%m-%d")
+        for step in steps:
+            tokens = step.get("tokens") or {}
+            cache = tokens.get("cache") or {}
+            rows.append((
+                step["id"], sid, info["id"], turn_id, info.get("providerID"), info.get("modelID"),
+                day, created, tokens.get("input") or 0, tokens.get("output") or 0,
+                tokens.get("reasoning") or 0, cache.get("read") or 0, cache.get("write") or 0,
+                step.get("cost") or 0,
+            ))
+    before = db.total_changes
+    db.executemany(
+        "INSERT OR IGNORE INTO ledger VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows
+    )
+    return db.total_changes - before
+
+
+def _today():
+    """The ledger's day key for today."""
+    return datetime.date.today().strftime("%Y-%m-%d")
+
+
+def _ledger_where(session=None, turn=None, day=None):
+    """WHERE clause and parameters selecting ledger rows."""
+    clauses, params = [], []
+    for column, value in (("session_id", session), ("turn_id", turn), ("day", day)):
+        if value is not None:
+            clauses.append(f"{column} = ?")
+            params.append(value)
+    return (" WHERE " + " AND ".join(clauses) if clauses else ""), params
+
+
+LEDGER_SUMS = (
+    "COUNT(DISTINCT COALESCE(turn_id, message_id)), SUM(tokens_input), SUM(tokens_output), "
+    "SUM(tokens_reasoning), SUM(cache_read), SUM(cache_write), SUM(cost)"
+)
+
+
+def ledger_totals(session=None, turn=None, day=None):
+    """(turns, input, output, reasoning, cache read, cache write, cost) over the
+    ledger rows matching every given filter."""
+    db = get_store()
+    if db is None:
+        return (0, 0, 0, 0, 0, 0, 0.0)
+    where, params = _ledger_where(session, turn, day)
+    with store_lock:
+        row = db.execute(f"SELECT {LEDGER_SUMS} FROM ledger{where}", params).fetchone()
+    return tuple(value or 0 for value in row)
+
+
+def ledger_by(group, limit=20):
+    """[(key, totals)] for the top `limit` groups: models and sessions by cost, days
+    newest first."""
+    db = get_store()
+    if db is None:
+        return []
+    key = LEDGER_GROUPS[group]
+    order = "day DESC" if group == "day" else "SUM(cost) DESC"
+    with store_lock:
+        rows = db.execute(
+            f"SELECT {key}, {LEDGER_SUMS} FROM ledger GROUP BY 1 ORDER BY {order} LIMIT ?", (limit,)
+        ).fetchall()
+    if group == "session":
+        rows = [(short_id(r[0]),) + tuple(r[1:]) for r in rows]
+    return [(r[0], tuple(value or 0 for value in r[1:])) for r in rows]
+
+
+def load_session_usage(sid):
+    """Tokens (input + output + reasoning), cost, assistant seconds and tool calls the
+    store has for a session (zeros without a store)."""
+    usage = dict.fromkeys(CAP_KINDS, 0)
+    db = get_store()
+    if db is None:
+        return usage
+    flush_pending_writes()
+    _, tokens_in, tokens_out, reasoning, _, _, usage["cost"] = ledger_totals(session=sid)
+    usage["tokens"] = tokens_in + tokens_out + reasoning
+    with store_lock:
+        usage["tools"] = db.execute(
+            "SELECT COUNT(*) FROM parts WHERE session_id = ? AND type = 'tool'", (sid,)
+        ).fetchone()[0]
+        usage["seconds"] = (db.execute(
+            "SELECT SUM(completed - created) FROM messages "
+            "WHERE session_id = ? AND role = 'assistant' AND completed IS NOT NULL", (sid,)
+        ).fetchone()[0] or 0) / 1000
+    return usage
+
+
+def last_turn_id(sid):
+    """The turn (user message id) of the session's most recent ledger row."""
+    db = get_store()
+    if db is None:
+        return None
+    with store_lock:
+        row = db.execute(
+            "SELECT turn_id FROM ledger WHERE session_id = ? ORDER BY created DESC LIMIT 1", (sid,)
+        ).fetchone()
+    return row[0] if row else None
+
+
+def _search_text(part):
+    """Text indexed for a raw part: its text, or tool name, title, input and output."""
+    ptype = part.get("type")
+    if ptype in ("text", "reasoning"):
+        text = part.get("text") or ""
+    elif ptype == "tool":
+        state = part.get("state") or {}
+        pieces = [
+            part.get("tool") or "",
+            state.get("title") or "",
+            json.dumps(state["input"]) if state.get("input") else "",
+            state.get("output") or "",
+            state.get("error") or "",
+        ]
+        text = "\n".join(piece for piece in pieces if piece)
+    else:
+        return None
+    return text[:SEARCH_MAX_CHARS] or None
+
+
+def store_sessions(sessions):
+    """Upsert session metadata (SDK Session objects) and add them to the prefix index."""
+    if sessions:
+        index_sessions(sessions)
+    db = get_store()
+    if db is None or not sessions:
+        return
+    rows = []
+    for s in sessions:
+        t = getattr(s, "time", None)
+        rows.append((
+            s.id,
+            getattr(s, "title", None),
+            getattr(t, "created", None),
+            getattr(t, "updated", None),
+        ))
+    try:
+        with store_lock, db:
+            db.executemany(
+                "INSERT INTO sessions (id, title, created, updated) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(id) DO UPDATE SET title = excluded.title, "
+                "created = COALESCE(excluded.created, created), "
+                "updated = COALESCE(excluded.updated, updated)",
+                rows,
+            )
+    except sqlite3.Error:
+        pass
+
+
+def store_messages(sid, raw_items):
+    """Write raw messages (as returned by GET /session/{id}/message) and their parts,
+    and add their finished steps to the cost ledger."""
+    db = get_store()
+    if db is None or not raw_items:
+        return
+    message_rows = []
+    part_rows = []
+    search_rows = []
+    for raw in raw_items:
+        info = raw["info"]
+        t = info.get("time") or {}
+        tokens = info.get("tokens") or {}
+        cache = tokens.get("cache") or {}
+        error = info.get("error")
+        message_rows.append((
+            info["id"],
+            info.get("sessionID") or sid,
+            info.get("role"),
+            t.get("created"),
+            t.get("completed"),
+            info.get("providerID"),
+            info.get("modelID"),
+            info.get("cost"),
+            tokens.get("input"),
+            tokens.get("output"),
+            tokens.get("reasoning"),
+            cache.get("read"),
+            cache.get("write"),
+            error.get("name") if isinstance(error, dict) else None,
+            json.dumps(info),
+        ))
+        for seq, part in enumerate(raw.get("parts") or []):
+            state = part.get("state") or {}
+            part_rows.append((
+                part["id"],
+                info["id"],
+                info.get("sessionID") or sid,
+                seq,
+                part.get("type"),
+                part.get("tool"),
+                state.get("status"),
+                part.get("text"),
+                json.dumps(part),
+            ))
+            search_rows.append(_search_text(part) if search_enabled else None)
+    try:
+        with store_lock, db:
+            db.executemany(
+                "INSERT OR REPLACE INTO messages VALUES "
+                "(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                message_rows,
+            )
+            message_ids = [(r[0],) for r in message_rows]
+            if search_enabled:
+                # The index shares rowids with parts; drop entries before the parts go
+                db.executemany(
+                    "DELETE FROM parts_fts WHERE rowid IN "
+                    "(SELECT rowid FROM parts WHERE message_id = ?)",
+                    message_ids,
+                )
+            db.executemany("DELETE FROM parts WHERE message_id = ?", message_ids)
+            for row, content in zip(part_rows, search_rows):
+                cur = db.execute(
+                    "INSERT OR REPLACE INTO parts VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", row
+                )
+                if content:
+                    db.execute(
+                        "INSERT INTO parts_fts (rowid, content) VALUES (?, ?)",
+                        (cur.lastrowid, content),
+                    )
+            db.execute(
+                "UPDATE sessions SET updated = MAX(COALESCE(updated, 0), ?) WHERE id = ?",
+                (max((r[3] or 0) for r in message_rows), sid),
+            )
+            new_steps = _record_steps(db, sid, raw_items)
+    except sqlite3.Error as e:
+        console.print(f"[yellow]Could not write transcript:[/] {e}")
+        return
+    if new_steps:
+        check_budgets(sid)
+
+
+def load_raw_messages(sid, newest=None, since=None):
+    """Raw messages of a session from the local store, oldest first.
+
+    `newest` limits to that many of the latest; `since` (epoch ms) to those
+    created after it. Parts are read only for the selected messages.
+    """
+    db = get_store()
+    if db is None:
+        return []
+    query = "SELECT id, info FROM messages WHERE session_id = ?"
+    params = [sid]
+    if since is not None:
+        query += " AND created >= ?"
+        params.append(since)
+    query += " ORDER BY created DESC, id DESC"
+    if newest:
+        query += " LIMIT ?"
+        params.append(newest)
+    with store_lock:
+        rows = db.execute(query, params).fetchall()[::-1]
+        parts = collections.defaultdict(list)
+        for mid, _ in rows:
+            for (data,) in db.execute(
+                "SELECT data FROM parts WHERE message_id = ? ORDER BY seq", (mid,)
+            ):
+                parts[mid].append(json.loads(data))
+    return [{"info": json.loads(info), "parts": parts[mid]} for mid, info in rows]
+
+
+def load_sessions(limit=None, offset=0, query=""):
+    """Sessions known to the local store, most recently updated first: all of them,
+    or `limit` from `offset` whose title contains `query` (case-insensitive)."""
+    db = get_store()
+    if db is None:
+        return []
+    pattern = "%" + re.sub(r"([%_\\])", r"\\\1", query) + "%"
+    with store_lock:
+        rows = db.execute(
+            "SELECT id, title, created, updated FROM sessions "
+            "WHERE ? = '%%' OR title LIKE ? ESCAPE '\\' "
+            "ORDER BY updated DESC LIMIT ? OFFSET ?",
+            (pattern, pattern, -1 if limit is None else limit, offset),
+        ).fetchall()
+    return [
+        types.SimpleNamespace(
+            id=sid, title=title, time=types.SimpleNamespace(created=created, updated=updated)
+        )
+        for sid, title, created, updated in rows
+    ]
+
+
+def _fts_query(query):
+    """Quote each word so user input can't trip FTS5 query syntax (words are ANDed)."""
+    words = query.split()
+    return " ".join('"' + word.replace('"', '""') + '"' for word in words)
+
+
+def _snippet(content, words, before=40, after=80):
+    """About `before` + `after` characters of `content` around the first of `words`,
+    cut at spaces, with every word in it wrapped in \x01/\x02 (like FTS5 snippet())."""
+    pattern = re.compile(
+        r"(?<!\w)(?:" + "|".join(re.escape(word) for word in words) + r")(?!\w)", re.IGNORECASE
+    )
+    match = pattern.search(content)
+    at = match.start() if match else 0
+    start = max(0, at - before)
+    end = min(len(content), at + after)
+    if start > 0:
+        space = content.find(" ", start, at)
+        start = space + 1 if space >= 0 else start
+    if end < len(content):
+        space = content.rfind(" ", at, end)
+        end = space if space > at else end
+    window = pattern.sub(lambda m: f"\x01{m.group(0)}\x02", content[start:end])
+    return ("…" if start > 0 else "") + window + ("…" if end < len(content) else "")
+
+
+def search_transcripts(query, limit=SEARCH_LIMIT):
+    """Ranked hits for `query` across all stored sessions.
+
+    Each hit is (session_id, title, message_id, part_id, role, kind, created, snippet)
+    with the matched terms wrapped in \x01/\x02.
+    """
+    db = get_store()
+    if db is None or not query.strip():
+        return []
+    columns = (
+        "p.session_id, s.title, p.message_id, p.id, m.role, "
+        "CASE WHEN p.tool IS NOT NULL THEN 'tool:' || p.tool ELSE p.type END, m.created, "
+    )
+    joins = (
+        "JOIN messages m ON m.id = p.message_id "
+        "LEFT JOIN sessions s ON s.id = p.session_id "
+    )
+    with store_lock:
+        if search_enabled:
+            # Rank first, then cut snippets from the top hits only: FTS5's
+            # snippet() walks every match of a part, and big tool outputs
+            # have thousands
+            ranked = [
+                rowid for (rowid,) in db.execute(
+                    "SELECT rowid FROM parts_fts WHERE parts_fts MATCH ? "
+                    "ORDER BY bm25(parts_fts) LIMIT ?",
+                    (_fts_query(query), limit),
+                )
+            ]
+            if not ranked:
+                return []
+            rows = {
+                row[0]: row[1:] for row in db.execute(
+                    "SELECT p.rowid, " + columns + "f.content "
+                    "FROM parts_fts f JOIN parts p ON p.rowid = f.rowid " + joins +
+                    f"WHERE f.rowid IN ({', '.join('?' * len(ranked))})",
+                    ranked,
+                )
+            }
+            words = query.split()
+            return [
+                rows[rowid][:-1] + (_snippet(rows[rowid][-1], words),)
+                for rowid in ranked if rowid in rows
+            ]
+        # No FTS5: unranked substring match over text parts
+        return db.execute(
+            "SELECT " + columns + "substr(p.text, 1, 120) FROM parts p " + joins +
+            "WHERE p.text LIKE ? ORDER BY m.created DESC LIMIT ?",
+            (f"%{query}%", limit),
+        ).fetchall()
+
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,476 @@
+#!/usr/bin/env python3
+"""stub_server — A local stand-in for the OpenCode server.
+
+Implements the routes chat.py relies on (see docs/implementation_notes.md)
+with canned, configurable responses so the client's own overhead can be
+measured without a real LLM behind it:
+
+    GET/POST   /session              (GET honours ?limit= and ?search=)
+    DELETE     /session/{id}
+    GET/POST   /session/{id}/message  (GET honours ?limit=)
+    POST       /session/{id}/abort
+    GET        /config/providers
+    GET        /event                (server-sent events)
+
+Run standalone with `python stub_server.py --port 54321`, or start it
+in-process with `start_server()` (used by bench.py and tests/).
+"""
+
+import argparse
+import json
+import queue
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# ---------------------------------------------------------------------------
+# Section A: Configuration & state
+# ---------------------------------------------------------------------------
+
+DEFAULTS = {
+    "latency": 0.0,          # seconds slept between streamed events of a turn
+    "text_size": 2000,       # characters of assistant text per turn
+    "text_chunks": 20,       # number of text deltas the text is streamed in
+    "tool_parts": 3,         # tool calls per turn
+    "tool_output_size": 2000,  # characters of output per tool call
+    "providers": 5,          # providers in /config/providers
+    "models": 40,            # models per provider
+    "session_paging": True,  # honour ?limit= and ?search= on GET /session ("limit": only
+                             # ?limit=, cutting the list in creation order)
+    "message_paging": True,  # honour ?limit= on GET /session/{id}/message
+    "event_limit": 0,        # close each /event stream after this many events (0 = never)
+}
+
+LOREM = (
+    "The quick brown fox jumps over the lazy dog. "
+    "Pack my box with five dozen liquor jugs. "
+    "```python\ndef retry(fn):\n    return fn()\n```\n\n"
+)
+
+
+def filler(size, seed=LOREM):
+    """Return `size` characters of repeating filler text."""
+    if size <= 0:
+        return ""
+    reps = size // len(seed) + 1
+    return (seed * reps)[:size]
+
+
+class StubState:
+    """All sessions, messages and event subscribers of one stub server."""
+
+    def __init__(self, **config):
+        self.config = dict(DEFAULTS, **config)
+        self.lock = threading.Lock()
+        self.sessions = {}      # session id -> session info dict
+        self.messages = {}      # session id -> list of {"info", "parts"}
+        self.aborted = set()    # session ids with a pending abort
+        self.subscribers = []   # queue.Queue per open /event stream
+        self.counter = 0
+
+    def next_id(self, prefix):
+        with self.lock:
+            self.counter += 1
+            return f"{prefix}_{self.counter:012d}"
+
+    def publish(self, etype, properties):
+        """Send an event to every open /event stream."""
+        event = {"type": etype, "properties": properties}
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for q in subscribers:
+            q.put(event)
+
+    # -- sessions ----------------------------------------------------------
+
+    def create_session(self, title=""):
+        sid = self.next_id("ses")
+        now = time.time() * 1000
+        info = {
+            "id": sid,
+            "title": title or f"Session {sid[-4:]}",
+            "version": "stub",
+            "time": {"created": now, "updated": now},
+        }
+        with self.lock:
+            self.sessions[sid] = info
+            self.messages[sid] = []
+        self.publish("session.updated", {"info": info})
+        return info
+
+    def seed_sessions(self, count):
+        """Create `count` empty sessions, updated one second apart."""
+        now = time.time() * 1000
+        with self.lock:
+            for i in range(count):
+                self.counter += 1
+                sid = f"ses_{self.counter:012d}"
+                updated = now - (count - i) * 1000
+                self.sessions[sid] = {
+                    "id": sid,
+                    "title": f"Task {i}: fix the retry bug" if i % 2 else f"Task {i}: review",
+                    "version": "stub",
+                    "time": {"created": updated, "updated": updated},
+                }
+                self.messages[sid] = []
+
+    def list_sessions(self, limit=None, search=None):
+        """Sessions most recently updated first, optionally filtered and cut."""
+        with self.lock:
+            sessions = list(self.sessions.values())
+        if not self.config["session_paging"]:
+            return sessions
+        if self.config["session_paging"] == "limit":
+            return sessions[:limit] if limit else sessions
+        if search:
+            sessions = [s for s in sessions if search.lower() in s["title"].lower()]
+        sessions.sort(key=lambda s: s["time"]["updated"], reverse=True)
+        return sessions[:limit] if limit else sessions
+
+    def seed_history(self, count, tool_output_size=None):
+        """Create a session pre-filled with `count` messages (half user, half assistant)."""
+        info = self.create_session(title=f"History of {count} messages")
+        sid = info["id"]
+        size = self.config["tool_output_size"] if tool_output_size is None else tool_output_size
+        for i in range(count // 2):
+            user, _ = self._user_message(sid, f"Question {i}: where is the retry bug?")
+            assistant = self._assistant_info(sid, completed=True)
+            parts = [
+                self._part(assistant["id"], sid, "step-start"),
+                self._tool_part(assistant["id"], sid, "completed", size),
+                self._text_part(assistant["id"], sid, filler(self.config["text_size"])),
+                self._step_finish(assistant["id"], sid),
+            ]
+            self.messages[sid].append({"info": assistant, "parts": parts})
+        return sid
+
+    # -- message construction -----------------------------------------------
+
+    def _user_message(self, sid, text):
+        mid = self.next_id("msg")
+        info = {
+            "id": mid,
+            "role": "user",
+            "sessionID": sid,
+            "time": {"created": time.time() * 1000},
+        }
+        parts = [self._text_part(mid, sid, text)]
+        self.messages[sid].append({"info": info, "parts": parts})
+        return info, parts
+
+    def _assistant_info(self, sid, completed=False):
+        now = time.time() * 1000
+        return {
+            "id": self.next_id("msg"),
+            "role": "assistant",
+            "sessionID": sid,
+            "cost": 0.0012,
+            "mode": "build",
+            "modelID": "stub-model",
+            "providerID": "stub",
+            "path": {"cwd": "/tmp", "root": "/tmp"},
+            "system": [],
+            "time": {"created": now, "completed": now if completed else None},
+            "tokens": {"input": 1200, "output": 300, "reasoning": 0,
+                       "cache": {"read": 0, "write": 0}},
+        }
+
+    def _part(self, mid, sid, ptype, **fields):
+        part = {"id": self.next_id("prt"), "messageID": mid, "sessionID": sid, "type": ptype}
+        part.update(fields)
+        return part
+
+    def _text_part(self, mid, sid, text):
+        return self._part(mid, sid, "text", text=text, time={"start": time.time() * 1000})
+
+    def _tool_part(self, mid, sid, status, output_size):
+        state = {"status": status, "input": {"pattern": "retry", "path": "."}}
+        if status in ("running", "completed"):
+            state["title"] = "grep retry"
+            state["time"] = {"start": time.time() * 1000}
+        if status == "completed":
+            state["output"] = filler(output_size, "src/retry.py:42: retry(fn)\n")
+            state["metadata"] = {}
+            state["time"]["end"] = time.time() * 1000
+        return self._part(mid, sid, "tool", tool="grep", callID=self.next_id("call"), state=state)
+
+    def _step_finish(self, mid, sid):
+        return self._part(
+            mid, sid, "step-finish", cost=0.0012,
+            tokens={"input": 1200, "output": 300, "reasoning": 0,
+                    "cache": {"read": 0, "write": 0}},
+        )
+
+    # -- a simulated agent turn ----------------------------------------------
+
+    def run_turn(self, sid, text):
+        """Simulate one agent turn, streaming events as it progresses."""
+        cfg = self.config
+        latency = cfg["latency"]
+        self.aborted.discard(sid)
+
+        user, user_parts = self._user_message(sid, text)
+        self.publish("message.updated", {"info": user})
+        for part in user_parts:
+            self.publish("message.part.updated", {"part": part})
+
+        info = self._assistant_info(sid)
+        entry = {"info": info, "parts": []}
+        self.messages[sid].append(entry)
+        self.publish("message.updated", {"info": info})
+
+        def emit(part, replace=None):
+            if replace is None:
+                entry["parts"].append(part)
+            else:
+                entry["parts"][replace] = part
+            self.publish("message.part.updated", {"part": part})
+            if latency:
+                time.sleep(latency)
+
+        emit(self._part(info["id"], sid, "step-start"))
+        for _ in range(cfg["tool_parts"]):
+            if sid in self.aborted:
+                break
+            pending = self._tool_part(info["id"], sid, "pending", 0)
+            emit(pending)
+            index = len(entry["parts"]) - 1
+            for status in ("running", "completed"):
+                part = self._tool_part(info["id"], sid, status, cfg["tool_output_size"])
+                part["id"] = pending["id"]
+                part["callID"] = pending["callID"]
+                emit(part, replace=index)
+
+        body = filler(cfg["text_size"])
+        text_part = self._text_part(info["id"], sid, "")
+        step = max(1, len(body) // max(1, cfg["text_chunks"]))
+        for end in range(step, len(body) + step, step):
+            if sid in self.aborted:
+                break
+            chunk = dict(text_part, text=body[:end])
+            if end == step:
+                emit(chunk)
+            else:
+                emit(chunk, replace=len(entry["parts"]) - 1)
+
+        emit(self._step_finish(info["id"], sid))
+
+        if sid in self.aborted:
+            info["error"] = {"name": "MessageAbortedError", "data": {}}
+        info["time"]["completed"] = time.time() * 1000
+        self.publish("message.updated", {"info": info})
+        self.publish("session.idle", {"sessionID": sid})
+        self.sessions[sid]["time"]["updated"] = time.time() * 1000
+        return entry
+
+    # -- catalog ---------------------------------------------------------------
+
+    def providers(self):
+        providers = []
+        for p in range(self.config["providers"]):
+            pid = "opencode" if p == 0 else f"provider{p}"
+            models = {}
+            for m in range(self.config["models"]):
+                mid = "kimi-k2.5-free" if m == 0 else f"model-{m}"
+                models[mid] = {
+                    "id": mid,
+                    "name": mid.title(),
+                    "attachment": False,
+                    "reasoning": False,
+                    "temperature": True,
+                    "tool_call": True,
+                    "release_date": "2026-01-01",
+                    "cost": {"input": 0.5 * m, "output": 1.5 * m},
+                    "limit": {"context": 200000, "output": 8192},
+                    "options": {},
+                }
+            providers.append({"id": pid, "name": pid.title(), "env": [], "models": models})
+        return {
+            "providers": providers,
+            "default": {p["id"]: next(iter(p["models"])) for p in providers},
+        }
+
+
+# ---------------------------------------------------------------------------
+# Section B: HTTP handler
+# ---------------------------------------------------------------------------
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Route requests to the server's StubState."""
+
+    protocol_version = "HTTP/1.1"
+
+    @property
+    def state(self):
+        return self.server.state
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, payload, status=200):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length) if length else b""
+        if not raw:
+            return None
+        return json.loads(raw)
+
+    def route(self):
+        url = urlparse(self.path)
+        parts = [p for p in url.path.split("/") if p]
+        return parts, parse_qs(url.query)
+
+    def do_GET(self):
+        parts, query = self.route()
+        if parts == ["session"]:
+            limit = query.get("limit")
+            search = query.get("search")
+            self.send_json(self.state.list_sessions(
+                int(limit[0]) if limit else None, search[0] if search else None
+            ))
+        elif len(parts) == 3 and parts[0] == "session" and parts[2] == "message":
+            messages = self.state.messages.get(parts[1])
+            if messages is None:
+                self.send_json({"error": "not found"}, status=404)
+                return
+            limit = query.get("limit")
+            if limit and self.state.config["message_paging"]:
+                messages = messages[-int(limit[0]):]
+            self.send_json(messages)
+        elif parts == ["config", "providers"]:
+            self.send_json(self.state.providers())
+        elif parts == ["event"]:
+            self.stream_events()
+        else:
+            self.send_json({"error": "not found"}, status=404)
+
+    def do_POST(self):
+        parts, _ = self.route()
+        if parts == ["session"]:
+            if self.read_json() is None:
+                self.send_json({"error": "Malformed JSON in request body"}, status=400)
+                return
+            self.send_json(self.state.create_session())
+        elif len(parts) == 3 and parts[0] == "session" and parts[2] == "message":
+            sid = parts[1]
+            body = self.read_json() or {}
+            if sid not in self.state.sessions:
+                self.send_json({"error": "not found"}, status=404)
+                return
+            text = " ".join(p.get("text", "") for p in body.get("parts", []))
+            self.send_json(self.state.run_turn(sid, text))
+        elif len(parts) == 3 and parts[0] == "session" and parts[2] == "abort":
+            self.state.aborted.add(parts[1])
+            self.send_json(True)
+        else:
+            self.send_json({"error": "not found"}, status=404)
+
+    def do_DELETE(self):
+        parts, _ = self.route()
+        if len(parts) == 2 and parts[0] == "session":
+            self.state.sessions.pop(parts[1], None)
+            self.state.messages.pop(parts[1], None)
+            self.send_json(True)
+        else:
+            self.send_json({"error": "not found"}, status=404)
+
+    def stream_events(self):
+        """Serve /event as server-sent events until the client disconnects."""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+        q = queue.Queue()
+        with self.state.lock:
+            self.state.subscribers.append(q)
+        limit = self.state.config["event_limit"]
+        sent = 0
+        try:
+            q.put({"type": "server.connected", "properties": {}})
+            while not limit or sent < limit:
+                try:
+                    event = q.get(timeout=1.0)
+                except queue.Empty:
+                    # Comment line as heartbeat; also detects dead clients
+                    self.wfile.write(b": ping\n\n")
+                    self.wfile.flush()
+                    continue
+                self.wfile.write(b"data: " + json.dumps(event).encode() + b"\n\n")
+                self.wfile.flush()
+                sent += 1
+        except (BrokenPipeError, ConnectionResetError, OSError):
+            pass
+        finally:
+            with self.state.lock:
+                self.state.subscribers.remove(q)
+
+
+# ---------------------------------------------------------------------------
+# Section C: Entry points
+# ---------------------------------------------------------------------------
+
+
+def start_server(port=0, **config):
+    """Start a stub server in a daemon thread; returns (server, base_url).
+
+    The server's StubState is available as `server.state`.
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", port), StubHandler)
+    server.daemon_threads = True
+    server.state = StubState(**config)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def main():
+    """Entry point."""
+    parser = argparse.ArgumentParser(description="Stand-in OpenCode server for benchmarks")
+    parser.add_argument("--port", type=int, default=54321)
+    parser.add_argument("--latency", type=float, default=DEFAULTS["latency"],
+                        help="seconds between streamed events of a turn")
+    parser.add_argument("--text-size", type=int, default=DEFAULTS["text_size"],
+                        help="characters of assistant text per turn")
+    parser.add_argument("--text-chunks", type=int, default=DEFAULTS["text_chunks"],
+                        help="number of deltas the text is streamed in")
+    parser.add_argument("--tool-parts", type=int, default=DEFAULTS["tool_parts"],
+                        help="tool calls per turn")
+    parser.add_argument("--tool-output-size", type=int, default=DEFAULTS["tool_output_size"],
+                        help="characters of output per tool call")
+    parser.add_argument("--providers", type=int, default=DEFAULTS["providers"])
+    parser.add_argument("--models", type=int, default=DEFAULTS["models"])
+    parser.add_argument("--history", type=int, default=0,
+                        help="pre-create a session with this many messages")
+    parser.add_argument("--sessions", type=int, default=0,
+                        help="pre-create this many empty sessions")
+    args = parser.parse_args()
+
+    config = {k: v for k, v in vars(args).items() if k in DEFAULTS}
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), StubHandler)
+    server.daemon_threads = True
+    server.state = StubState(**config)
+    if args.sessions:
+        server.state.seed_sessions(args.sessions)
+    if args.history:
+        sid = server.state.seed_history(args.history)
+        print(f"Seeded session {sid} with {args.history} messages")
+    print(f"opencode stub server listening on http://127.0.0.1:{args.port}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
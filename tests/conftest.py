@@ -0,0 +1,45 @@
+"""Shared fixtures: chat.py pointed at a scratch store and an in-process stub server."""
+
+import io
+import os
+import shutil
+import sys
+import tempfile
+
+import pytest
+from rich.console import Console
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+# chat.py reads its store and cache paths at import time; keep the tests'
+# sessions and transcripts out of the user's own store, as bench.py does
+SCRATCH = tempfile.mkdtemp(prefix="opencode-tests-")
+os.environ["OPENCODE_CHAT_DB"] = os.path.join(SCRATCH, "transcripts.db")
+os.environ["OPENCODE_CHAT_CACHE_DIR"] = SCRATCH
+
+import chat  # noqa: E402
+from stub_server import start_server  # noqa: E402
+
+
+def pytest_sessionfinish(session, exitstatus):
+    shutil.rmtree(SCRATCH, True)
+
+
+@pytest.fixture(autouse=True)
+def quiet_console(monkeypatch):
+    """Send chat.py's output to an in-memory console; the test reads it from .file."""
+    console = Console(file=io.StringIO(), width=80, force_terminal=False)
+    monkeypatch.setattr(chat, "console", console)
+    return console
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    """A stub server with chat.client pointed at it; yields its StubState."""
+    server, url = start_server(text_size=200, tool_output_size=200)
+    monkeypatch.setattr(chat, "client", chat.make_client(url))
+    monkeypatch.setattr(chat, "message_cache", {})
+    yield server.state
+    server.shutdown()
+    server.server_close()
@@ -0,0 +1,407 @@
+"""Tests for chat.py's incremental fetch, Markdown cutting, argument parsing,
+session index, cost ledger and turn caps (run with `python -m pytest -q`)."""
+
+import datetime
+import io
+import sqlite3
+import time
+import types
+
+import pytest
+from rich.console import Console
+from rich.markdown import Markdown
+
+import chat
+
+# ---------------------------------------------------------------------------
+# Section A: fetch_messages
+# ---------------------------------------------------------------------------
+
+
+def add_turn(state, sid):
+    """Append a finished user/assistant exchange to a stub session."""
+    state._user_message(sid, "and now?")
+    info = state._assistant_info(sid, completed=True)
+    parts = [state._text_part(info["id"], sid, "done"), state._step_finish(info["id"], sid)]
+    state.messages[sid].append({"info": info, "parts": parts})
+
+
+def record_fetches(monkeypatch):
+    """Record the `limit` of every GET /session/{id}/message chat.py makes."""
+    limits = []
+    fetch = chat._fetch_raw_messages
+
+    def recording(sid, limit=None):
+        limits.append(limit)
+        return fetch(sid, limit)
+
+    monkeypatch.setattr(chat, "_fetch_raw_messages", recording)
+    return limits
+
+
+def ids(messages):
+    return [msg.id for msg in messages]
+
+
+def server_ids(state, sid):
+    return [raw["info"]["id"] for raw in state.messages[sid]]
+
+
+def test_fetch_messages_merges_the_window_into_the_cache(stub, monkeypatch):
+    sid = stub.seed_history(40)
+    limits = record_fetches(monkeypatch)
+    assert ids(chat.fetch_messages(sid)) == server_ids(stub, sid)
+    first = chat.fetch_messages(sid)[0]
+    add_turn(stub, sid)
+    messages = chat.fetch_messages(sid)
+    assert ids(messages) == server_ids(stub, sid)
+    assert messages[0] is first  # settled messages outside the window are kept
+    assert limits == [None, chat.MESSAGE_WINDOW, chat.MESSAGE_WINDOW]
+
+
+def test_fetch_messages_refetches_when_the_window_misses_the_cache(stub, monkeypatch):
+    sid = stub.seed_history(10)
+    limits = record_fetches(monkeypatch)
+    chat.fetch_messages(sid)
+    for _ in range(chat.MESSAGE_WINDOW):
+        add_turn(stub, sid)
+    assert ids(chat.fetch_messages(sid)) == server_ids(stub, sid)
+    assert limits == [None, chat.MESSAGE_WINDOW, None]
+
+
+def test_fetch_messages_drops_messages_the_server_no_longer_returns(stub):
+    sid = stub.seed_history(10)
+    chat.fetch_messages(sid)
+    del stub.messages[sid][-2:]
+    assert ids(chat.fetch_messages(sid)) == server_ids(stub, sid)
+
+
+def test_fetch_messages_stops_filtering_when_the_server_ignores_limit(stub, monkeypatch):
+    stub.config["message_paging"] = False
+    sid = stub.seed_history(40)
+    limits = record_fetches(monkeypatch)
+    chat.fetch_messages(sid)
+    add_turn(stub, sid)
+    assert ids(chat.fetch_messages(sid)) == server_ids(stub, sid)
+    add_turn(stub, sid)
+    assert ids(chat.fetch_messages(sid)) == server_ids(stub, sid)
+    assert limits == [None, chat.MESSAGE_WINDOW, None]
+
+
+# ---------------------------------------------------------------------------
+# Section B: Markdown cut points
+# ---------------------------------------------------------------------------
+
+
+def test_markdown_blocks_splits_fenced_code_from_prose():
+    text = "intro\n```py\nx = 1\n```\nmiddle\n~~~~\nraw\n~~~\n~~~~\nend"
+    assert list(chat.markdown_blocks(text)) == [
+        ("markdown", None, "intro"),
+        ("code", "py", "x = 1"),
+        ("markdown", None, "middle"),
+        ("code", "text", "raw\n~~~"),
+        ("markdown", None, "end"),
+    ]
+
+
+def test_markdown_blocks_runs_an_unclosed_fence_to_the_end():
+    assert list(chat.markdown_blocks("a\n\n```js\nlet x;\n\nmore")) == [
+        ("markdown", None, "a\n"),
+        ("code", "js", "let x;\n\nmore"),
+    ]
+
+
+def test_markdown_blocks_cuts_long_prose_at_blank_lines(monkeypatch):
+    monkeypatch.setattr(chat, "MARKDOWN_CHUNK", 10)
+    text = "first paragraph\n\nsecond\nparagraph\n\nthird"
+    assert [source for _, _, source in chat.markdown_blocks(text)] == [
+        "first paragraph", "second\nparagraph", "third",
+    ]
+    assert list(chat.markdown_blocks("\n\n  \n")) == []
+
+
+def stream_chunks(monkeypatch, text, step=1):
+    """Feed `text` to a StreamRenderer `step` characters at a time; returns what
+    each render_markdown() call got, then what finishing the part rendered."""
+    chunks = []
+    monkeypatch.setattr(chat, "render_markdown", lambda chunk, layout=None: chunks.append(chunk))
+    renderer = chat.StreamRenderer("s")
+    for n in range(step, len(text) + step, step):
+        part = types.SimpleNamespace(type="text", id="p", message_id="m", text=text[:n], time=None)
+        renderer.on_part(part)
+    streamed = list(chunks)
+    renderer.finish()
+    return streamed, chunks[len(streamed):]
+
+
+def test_render_text_cuts_before_a_new_paragraph(monkeypatch):
+    streamed, rest = stream_chunks(monkeypatch, "one\ntwo\n\nthree\n\nfour\n")
+    assert streamed == ["one\ntwo\n\n", "three\n\n"]
+    assert rest == ["four\n"]
+
+
+def test_render_text_keeps_lists_and_quotes_with_their_block(monkeypatch):
+    streamed, rest = stream_chunks(monkeypatch, "intro\n\n- a\n\n- b\n\n> q\n\n    code\n\nnext\n")
+    assert streamed == ["intro\n\n- a\n\n- b\n\n> q\n\n    code\n\n"]
+    assert rest == ["next\n"]
+
+
+def test_render_text_cuts_around_fences(monkeypatch):
+    streamed, rest = stream_chunks(monkeypatch, "text\n```py\nx\n\ny\n```\nafter\n", step=3)
+    assert streamed == ["text\n", "```py\nx\n\ny\n```\n"]
+    assert rest == ["after\n"]
+
+
+def render(fn):
+    """What `fn` prints to chat.console."""
+    chat.console = Console(file=io.StringIO(), width=80, force_terminal=False)
+    fn()
+    return chat.console.file.getvalue()
+
+
+@pytest.mark.parametrize("text", [
+    "# Title\n\nSome *prose*\nmore.\n\n- a\n- b\n\n```python\nx = 1\n\ny = 2\n```\nafter code\n"
+    "\n~~~\nraw\n~~~\n\n> quote\n\n---\n\nlast",
+    "1. a\n\n2. b\n\n| a |\n|---|\n| 1 |\n\n```\ncode\n```\n```js\nmore\n```\n- list\n",
+])
+def test_streamed_text_renders_like_one_markdown(text):
+    whole = render(lambda: chat.console.print(Markdown(text)))
+    assert render(lambda: chat.render_text(types.SimpleNamespace(text=text))) == f"\n{whole}\n"
+
+    def stream():
+        renderer = chat.StreamRenderer("s")
+        for n in range(1, len(text) + 1, 5):
+            renderer.on_part(types.SimpleNamespace(type="text", id="p", text=text[:n], time=None))
+        renderer.on_part(types.SimpleNamespace(type="text", id="p", text=text, time=None))
+        renderer.finish()
+
+    assert render(stream).strip("\n") == whole.strip("\n")
+
+
+# ---------------------------------------------------------------------------
+# Section C: Argument parsing
+# ---------------------------------------------------------------------------
+
+
+def test_parse_since_relative():
+    now = time.time() * 1000
+    assert abs(chat.parse_since("90m") - (now - 90 * 60_000)) < 5000
+    assert abs(chat.parse_since("2w") - (now - 14 * 86_400_000)) < 5000
+
+
+def test_parse_since_clock_and_iso():
+    today = datetime.datetime.combine(datetime.date.today(), datetime.time(14, 30))
+    assert chat.parse_since("14:30") == int(today.timestamp() * 1000)
+    assert chat.parse_since("2024-05-01") == int(datetime.datetime(2024, 5, 1).timestamp() * 1000)
+
+
+@pytest.mark.parametrize("text", ["yesterday", "25:99", "5x", ""])
+def test_parse_since_rejects(text):
+    with pytest.raises(ValueError):
+        chat.parse_since(text)
+
+
+def test_parse_history_args():
+    assert chat.parse_history_args("") == {}
+    assert chat.parse_history_args("3 --LAST 20 --local") == {"page": 3, "last": 20, "local": True}
+    assert chat.parse_history_args("--since 1d")["since"] < time.time() * 1000
+
+
+@pytest.mark.parametrize("arg", ["0", "--last", "--last 0", "--last x", "--since soon", "word"])
+def test_parse_history_args_rejects(arg):
+    with pytest.raises(ValueError):
+        chat.parse_history_args(arg)
+
+
+def test_parse_sessions_args():
+    assert chat.parse_sessions_args("") == {}
+    assert chat.parse_sessions_args("retry Bug --limit 5 --offset 0 --local") == {
+        "query": "retry Bug", "limit": 5, "offset": 0, "local": True,
+    }
+
+
+@pytest.mark.parametrize("arg", ["--limit", "--limit 0", "--offset -1", "--limit x", "--all"])
+def test_parse_sessions_args_rejects(arg):
+    with pytest.raises(ValueError):
+        chat.parse_sessions_args(arg)
+
+
+# ---------------------------------------------------------------------------
+# Section D: Session index
+# ---------------------------------------------------------------------------
+
+
+@pytest.fixture
+def session_index(monkeypatch):
+    """An empty session prefix index, instead of one loaded from the store."""
+    index = {"ids": [], "titles": [], "title": {}}
+    monkeypatch.setattr(chat, "session_index", index)
+    return index
+
+
+def sessions(*pairs):
+    return [types.SimpleNamespace(id=sid, title=title) for sid, title in pairs]
+
+
+def test_index_add_inserts_and_retitles(session_index):
+    chat._index_add(sessions(("ses_b", "Beta"), ("ses_a", "alpha")))
+    chat._index_add(sessions(("ses_b", "Gamma"), ("ses_a", "alpha"), ("ses_c", None)))
+    assert session_index["ids"] == ["ses_a", "ses_b", "ses_c"]
+    assert session_index["titles"] == [("", "ses_c"), ("alpha", "ses_a"), ("gamma", "ses_b")]
+    assert [s.id for s in chat.lookup_sessions("GAM")] == ["ses_b"]
+    assert [s.id for s in chat.lookup_sessions("ses_")] == ["ses_a", "ses_b", "ses_c"]
+
+
+def test_index_add_bulk_keeps_keys_sorted(session_index):
+    chat._index_add(sessions(*((f"ses_{i:03}", f"T{i % 7}") for i in range(100, 0, -1))))
+    assert session_index["ids"] == sorted(session_index["ids"])
+    assert session_index["titles"] == sorted(session_index["titles"])
+    assert len(session_index["ids"]) == 100
+
+
+def test_short_id_is_the_shortest_unique_prefix(session_index):
+    chat._index_add(sessions(
+        ("ses_0123456789", ""), ("ses_0123456abc", ""), ("ses_0123999999", ""), ("ses_9", ""),
+    ))
+    assert chat.short_id("ses_0123456789") == "ses_01234567"
+    assert chat.short_id("ses_0123999999") == "ses_01239"
+    assert chat.short_id("ses_9") == "ses_9"
+    assert chat.short_id("ses_0123999999", minimum=12) == "ses_01239999"
+
+
+# ---------------------------------------------------------------------------
+# Section E: Cost ledger
+# ---------------------------------------------------------------------------
+
+
+def exchange(user_id, assistant_id, steps, created=1_700_000_000_000, cost=0.5):
+    """A raw user message and an assistant reply with `steps` step-finish parts."""
+    step_parts = [
+        {"id": step_id, "type": "step-finish", "cost": 0.25,
+         "tokens": {"input": 100, "output": 10, "reasoning": 0, "cache": {"read": 5}}}
+        for step_id in steps
+    ]
+    return [
+        {"info": {"id": user_id, "role": "user", "time": {"created": created}}, "parts": []},
+        {"info": {"id": assistant_id, "role": "assistant", "cost": cost, "providerID": "p",
+                  "modelID": "m", "time": {"created": created + 1, "completed": created + 2}},
+         "parts": [{"id": "prt_text", "type": "text", "text": "hi"}] + step_parts},
+    ]
+
+
+@pytest.fixture
+def ledger_db():
+    db = sqlite3.connect(":memory:")
+    db.executescript(chat.STORE_SCHEMA)
+    yield db
+    db.close()
+
+
+def test_record_steps_adds_each_step_once(ledger_db):
+    raw_items = exchange("msg_u1", "msg_a1", ["prt_s1", "prt_s2"])
+    assert chat._record_steps(ledger_db, "ses", raw_items) == 2
+    assert chat._record_steps(ledger_db, "ses", raw_items) == 0
+    raw_items[1]["parts"].append(dict(raw_items[1]["parts"][-1], id="prt_s3"))
+    assert chat._record_steps(ledger_db, "ses", raw_items) == 1
+    rows = ledger_db.execute(
+        "SELECT step_id, turn_id, tokens_input, cache_read, cost FROM ledger ORDER BY step_id"
+    ).fetchall()
+    assert rows == [
+        ("prt_s1", "msg_u1", 100, 5, 0.25),
+        ("prt_s2", "msg_u1", 100, 5, 0.25),
+        ("prt_s3", "msg_u1", 100, 5, 0.25),
+    ]
+
+
+def test_record_steps_falls_back_to_the_message_totals(ledger_db):
+    raw_items = exchange("msg_u1", "msg_a1", [])
+    assert chat._record_steps(ledger_db, "ses", raw_items) == 1
+    assert chat._record_steps(ledger_db, "ses", raw_items) == 0
+    assert ledger_db.execute("SELECT step_id, cost FROM ledger").fetchall() == [("msg_a1", 0.5)]
+
+
+def test_record_steps_finds_the_turn_of_a_lone_assistant_message(ledger_db):
+    ledger_db.execute(
+        "INSERT INTO messages (id, session_id, role, created, info) "
+        "VALUES ('msg_u0', 'ses', 'user', 1, '{}')"
+    )
+    raw_items = exchange("msg_u1", "msg_a1", ["prt_s1"])[1:]
+    assert chat._record_steps(ledger_db, "ses", raw_items) == 1
+    assert ledger_db.execute("SELECT turn_id FROM ledger").fetchone() == ("msg_u0",)
+
+
+# ---------------------------------------------------------------------------
+# Section F: Turn caps
+# ---------------------------------------------------------------------------
+
+
+@pytest.fixture
+def caps(monkeypatch):
+    """Turn and session caps, all off until a test sets them."""
+    turn = dict.fromkeys(chat.CAP_KINDS, 0)
+    session = dict.fromkeys(chat.CAP_KINDS, 0)
+    monkeypatch.setattr(chat, "turn_caps", turn)
+    monkeypatch.setattr(chat, "session_caps", session)
+    return turn, session
+
+
+def event(etype, **props):
+    return types.SimpleNamespace(type=etype, properties=types.SimpleNamespace(**props))
+
+
+def assistant(sid, mid="msg_a"):
+    info = types.SimpleNamespace(id=mid, session_id=sid, role="assistant")
+    return event("message.updated", info=info)
+
+
+def step(pid, output, mid="msg_a"):
+    tokens = types.SimpleNamespace(input=0, output=output, reasoning=None)
+    part = types.SimpleNamespace(
+        id=pid, message_id=mid, type="step-finish", tokens=tokens, cost=0.1
+    )
+    return event("message.part.updated", part=part)
+
+
+def tool(pid, mid="msg_a"):
+    part = types.SimpleNamespace(id=pid, message_id=mid, type="tool")
+    return event("message.part.updated", part=part)
+
+
+def test_turn_guard_is_off_without_caps(caps):
+    assert chat.turn_guard("ses") is None
+
+
+def test_turn_guard_aborts_once_a_turn_cap_is_exceeded(stub, caps):
+    caps[0]["tokens"] = 250
+    sid = stub.create_session()["id"]
+    reports = []
+    guard = chat.TurnGuard(sid, reports.append)
+    guard.handle(step("prt_1", 200))  # not yet known to be this session's reply
+    guard.handle(assistant(sid))
+    guard.handle(step("prt_1", 200))
+    guard.handle(step("prt_1", 200))  # the same part again counts once
+    assert guard.reason is None and guard.usage["tokens"] == 200
+    guard.handle(step("prt_2", 100))
+    assert guard.reason == "turn tokens cap of 250 tokens exceeded (300 tokens)"
+    guard.handle(step("prt_3", 100))
+    assert len(reports) == 1 and "Aborted the turn" in reports[0]
+    assert sid in stub.aborted
+
+
+def test_turn_guard_ignores_other_sessions(caps):
+    caps[0]["tools"] = 1
+    guard = chat.TurnGuard("ses_mine", lambda text: None)
+    guard.handle(assistant("ses_other", "msg_x"))
+    guard.handle(tool("prt_1", "msg_x"))
+    guard.handle(tool("prt_2", "msg_x"))
+    assert guard.usage["tools"] == 0 and guard.reason is None
+
+
+def test_turn_guard_adds_earlier_usage_to_session_caps(caps, monkeypatch):
+    caps[1]["cost"] = 1.0
+    earlier = dict.fromkeys(chat.CAP_KINDS, 0)
+    earlier["cost"] = 1.5
+    monkeypatch.setattr(chat, "load_session_usage", lambda sid: earlier)
+    guard = chat.turn_guard("ses", lambda text: None)
+    assert guard.reason == "session cost cap of $1.0000 exceeded ($1.5000)"
+    assert guard.timer is None  # refused turns are never armed